@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+NutriPlan backend benchmarks
+
+Runs the server code in-process with the fake LLM backend, so no LLM quota or
+network access is needed:
+
+    cd backend && python bench.py [compact|macro|validation|serialize|projection ...]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tracemalloc
+import statistics
+from datetime import datetime
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+
+import server
+
+SAMPLE_PROFILE = {
+    "gender": "male",
+    "age": 30,
+    "weight": 75.5,
+    "height": 175.0,
+    "activity_level": "moderately_active",
+    "fitness_goal": "weight_loss",
+    "calorie_target": 2000,
+    "protein_target": 150,
+    "fiber_target": 30,
+    "dietary_restrictions": ["vegetarian"],
+    "allergies": ["peanuts"]
+}
+
+def count_tokens(text: str) -> int:
+    """Token count with tiktoken when available, else the ~4 chars/token estimate"""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except ImportError:
+        return len(text) // 4
+
+def bench_compact(runs: int = 5, tokens_per_second: float = 60):
+    """Output tokens and latency of the verbose vs compact wire schema"""
+    print(f"Full-week generation with the fake LLM at {tokens_per_second:g} tokens/s, {runs} runs each")
+    print(f"{'schema':<10}{'output tokens':>15}{'bytes':>10}{'latency (s)':>14}{'days parsed':>14}")
+
+    for compact in (False, True):
+        backend = server.FakeLLMBackend(latency_ms=500, latency_sigma=0, tokens_per_second=tokens_per_second, seed=1)
+        prompt = server.build_week_prompt(SAMPLE_PROFILE, compact)
+        tokens, sizes, latencies, parsed = [], [], [], []
+
+        for _ in range(runs):
+            started = time.perf_counter()
+            response = asyncio.run(backend.send_prompt(prompt, server.LLM_SYSTEM_MESSAGE))
+            latencies.append(time.perf_counter() - started)
+
+            parser = server.MealPlanStreamParser(compact=compact)
+            parser.feed(response)
+            tokens.append(count_tokens(response))
+            sizes.append(len(response.encode("utf-8")))
+            parsed.append(len(parser.days))
+
+        print(f"{'compact' if compact else 'verbose':<10}{statistics.mean(tokens):>15.0f}"
+              f"{statistics.mean(sizes):>10.0f}{statistics.mean(latencies):>14.2f}{min(parsed):>14}")
+
+def build_synthetic_library(size: int, seed: int = 7) -> "server.MealLibrary":
+    """A library of `size` meals split evenly across meal types with random nutrition"""
+    rng = random.Random(seed)
+    library = server.MealLibrary()
+    diet_sets = [set(), {"vegetarian", "pescatarian"}, {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}]
+    allergen_sets = [set(), {"dairy"}, {"gluten"}, {"nuts"}, {"fish"}]
+    for index in range(size):
+        meal_type = server.MEAL_TYPES[index % len(server.MEAL_TYPES)]
+        calories = rng.uniform(250, 800)
+        library.add({
+            "meal_id": f"{meal_type}-{index}",
+            "meal_type": meal_type,
+            "name": f"Synthetic {meal_type} {index}",
+            "recipe": {"ingredients": [], "instructions": []},
+            "nutrition": {
+                "calories": calories,
+                "protein": rng.uniform(5, 55),
+                "carbs": calories * rng.uniform(0.05, 0.15),
+                "fat": calories * rng.uniform(0.01, 0.05),
+                "fiber": rng.uniform(1, 15),
+                "sugar": rng.uniform(0, 20)
+            },
+            "diets": set(rng.choice(diet_sets)),
+            "allergens": set(rng.choice(allergen_sets))
+        })
+    return library
+
+def bench_macro(sizes=(1000, 10000, 100000), repeats: int = 20, k: int = 10):
+    """Week solve and top-k day ranking throughput as the meal library grows"""
+    server.MEAL_LIBRARY_MAX_SIZE = max(sizes)
+    print(f"{'library size':>13}{'build (s)':>11}{'top-k (ms)':>12}{'week (ms)':>11}{'weeks/s':>9}{'solved':>8}")
+
+    for size in sizes:
+        started = time.perf_counter()
+        server.meal_library = build_synthetic_library(size)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(repeats):
+            server.top_library_days(SAMPLE_PROFILE, k)
+        top_k_ms = (time.perf_counter() - started) / repeats * 1000
+
+        started = time.perf_counter()
+        for _ in range(repeats):
+            plan = server.solve_meal_plan_from_library(SAMPLE_PROFILE)
+        week_ms = (time.perf_counter() - started) / repeats * 1000
+
+        print(f"{size:>13}{build_seconds:>11.2f}{top_k_ms:>12.2f}{week_ms:>11.2f}{1000 / week_ms:>9.0f}{str(plan is not None):>8}")
+
+def bench_validation(repeats: int = 2000):
+    """Per-plan cost of validating all 21 meal slots, with and without unit strings to coerce"""
+    clean = server.select_fallback_plan(SAMPLE_PROFILE)
+    with_units = {"days": [
+        {**day, **{
+            meal_type: {**day[meal_type], "nutrition": {
+                field: f"{value} {'kcal' if field == 'calories' else 'g'}"
+                for field, value in day[meal_type]["nutrition"].items()
+            }}
+            for meal_type in server.MEAL_TYPES
+        }}
+        for day in clean["days"]
+    ]}
+    print(f"{'plan':<12}{'us/plan':>10}{'plans/s':>10}{'invalid':>9}")
+
+    for label, plan in (("clean", clean), ("with units", with_units)):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            _, invalid = server.validate_meal_plan(plan)
+        seconds = (time.perf_counter() - started) / repeats
+        print(f"{label:<12}{seconds * 1e6:>10.0f}{1 / seconds:>10.0f}{len(invalid):>9}")
+
+def measure(render, repeats: int):
+    """Mean seconds per call and peak traced allocation of a single call"""
+    started = time.perf_counter()
+    for _ in range(repeats):
+        render()
+    seconds = (time.perf_counter() - started) / repeats
+
+    tracemalloc.start()
+    render()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+def bench_serialize(sizes=(1, 10, 50), repeats: int = 500):
+    """Response rendering of meal plan payloads: jsonable_encoder + json vs AppJSONResponse"""
+    from bson import ObjectId
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    plan = server.select_fallback_plan(SAMPLE_PROFILE)
+    print(f"{'plans':>6}{'bytes':>9}{'json (us)':>11}{'orjson (us)':>13}{'speedup':>9}{'json peak KiB':>15}{'orjson peak KiB':>17}")
+
+    for size in sizes:
+        documents = [
+            {"_id": ObjectId(), "meal_plan_id": f"plan-{index}", "meal_plan": plan, "created_at": datetime.utcnow()}
+            for index in range(size)
+        ]
+        payload = documents[0] if size == 1 else {"meal_plans": documents}
+
+        stdlib_seconds, stdlib_peak = measure(lambda: JSONResponse(jsonable_encoder(payload, custom_encoder={ObjectId: str})).body, repeats)
+        orjson_seconds, orjson_peak = measure(lambda: server.AppJSONResponse(payload).body, repeats)
+        size_bytes = len(server.AppJSONResponse(payload).body)
+
+        print(f"{size:>6}{size_bytes:>9}{stdlib_seconds * 1e6:>11.0f}{orjson_seconds * 1e6:>13.0f}"
+              f"{stdlib_seconds / orjson_seconds:>8.1f}x{stdlib_peak / 1024:>15.0f}{orjson_peak / 1024:>17.0f}")
+
+def project(value, paths):
+    """Apply a Mongo inclusion projection (dotted paths, arrays traversed) to a document"""
+    if isinstance(value, list):
+        return [project(item, paths) for item in value]
+    nested = {}
+    for path in paths:
+        head, _, rest = path.partition(".")
+        nested.setdefault(head, []).append(rest)
+    projected = {}
+    for head, rests in nested.items():
+        if head in value:
+            projected[head] = value[head] if "" in rests else project(value[head], rests)
+    return projected
+
+def bench_projection(repeats: int = 2000):
+    """BSON bytes and client decode time of whole documents vs the projected reads"""
+    import bson
+    from bson import ObjectId
+
+    plan = server.select_fallback_plan(SAMPLE_PROFILE)
+    user = {
+        "_id": ObjectId(),
+        "user_id": "2f1c7d9e-5b1a-4c57-9f7e-0a3d2c1b4e6f",
+        "username": "sample_user",
+        "password": server.pwd_context.hash("correct horse battery staple"),
+        "profile": SAMPLE_PROFILE,
+        "created_at": datetime.utcnow().isoformat(),
+        "updated_at": datetime.utcnow().isoformat()
+    }
+    meal_plan = {
+        "_id": ObjectId(),
+        "meal_plan_id": "7b0e2f4a-9c3d-4e1f-8a6b-5d2c1e0f9a8b",
+        "user_id": user["user_id"],
+        "meal_plan": server.add_dining_out_flags(plan),
+        "created_at": datetime.utcnow()
+    }
+    cases = [
+        ("current user", user, server.USER_PRINCIPAL_PROJECTION),
+        ("latest plan", meal_plan, {"_id": 0, "meal_plan_id": 1, "meal_plan": 1, "created_at": 1}),
+        ("grocery list", meal_plan, server.GROCERY_PROJECTION),
+    ]
+    print(f"{'read':<14}{'bytes':>8}{'projected':>11}{'decode (us)':>13}{'projected (us)':>16}")
+
+    for label, document, projection in cases:
+        paths = [path for path, included in projection.items() if included]
+        full = bson.encode(document)
+        projected = bson.encode(project(document, paths))
+        timings = []
+        for data in (full, projected):
+            started = time.perf_counter()
+            for _ in range(repeats):
+                bson.decode(data)
+            timings.append((time.perf_counter() - started) / repeats * 1e6)
+        print(f"{label:<14}{len(full):>8}{len(projected):>11}{timings[0]:>13.1f}{timings[1]:>16.1f}")
+
+BENCHMARKS = {
+    "compact": bench_compact,
+    "macro": bench_macro,
+    "validation": bench_validation,
+    "serialize": bench_serialize,
+    "projection": bench_projection,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit(f"Unknown benchmark {name!r}; choose from {', '.join(BENCHMARKS)}")
+        print(f"=== {name} ===")
+        BENCHMARKS[name]()
+        print()
@@ -0,0 +1,203 @@
+"""
+Incremental parsing and repair of LLM meal plan responses.
+
+Kept free of the server's dependencies so the parsing logic can be tested offline.
+"""
+
+import json
+from typing import Optional, List
+
+MEAL_TYPES = ["breakfast", "lunch", "dinner"]
+
+NUTRITION_FIELDS = ["calories", "protein", "carbs", "fat", "fiber", "sugar"]
+
+def repair_truncated_json(text: str) -> Optional[str]:
+    """Close a JSON document that was cut off mid-stream.
+    
+    The text is cut back to the last point where every open value was complete
+    (just before a ',' or just after a '{' or '['), dropping a dangling string,
+    key or number, and the open arrays and objects are then closed in order.
+    Returns None if the text never opened an object or array.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    cut = None
+    for i, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append('}' if char == '{' else ']')
+            cut = (i + 1, len(stack))
+        elif char in '}]':
+            if stack:
+                stack.pop()
+            if not stack:
+                return text[:i + 1]
+            cut = (i + 1, len(stack))
+        elif char == ',' and stack:
+            cut = (i, len(stack))
+    
+    if cut is None:
+        return None
+    position, depth = cut
+    return text[:position] + "".join(reversed(stack[:depth]))
+
+class MealPlanStreamParser:
+    """Incremental parser for the {"days": [...]} meal plan schema.
+    
+    Text can be fed in arbitrary chunks. The root object is the first one that
+    holds a "days" array; anything before it (markdown fences, preambles, even
+    braced asides) and after it closes is ignored. Each object
+    inside the "days" array is decoded as soon as its closing brace arrives, so
+    only that day's text is ever copied. Days that fail to decode are recorded in
+    `failed_days` with their position instead of discarding the whole response.
+    With compact=True each day is expanded from the compact wire schema, and
+    meal_types lists the meals every day must contain. If the response was cut
+    off, repair() salvages the day that was in progress.
+    """
+    
+    def __init__(self, compact: bool = False, meal_types: Optional[List[str]] = None):
+        self.compact = compact
+        self.meal_types = meal_types or MEAL_TYPES
+        self.days = []
+        self.failed_days = []
+        self.started = False
+        self.complete = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_chars = None
+        self._last_key = None
+        self._days_depth = None
+        self._saw_days = False
+        self._day_chunks = None
+        self._day_index = 0
+    
+    def feed(self, chunk: str) -> List[dict]:
+        """Consume a chunk of response text and return the days completed by it"""
+        completed = []
+        if self.complete:
+            return completed
+        
+        day_start = 0 if self._day_chunks is not None else None
+        for i, char in enumerate(chunk):
+            if not self.started:
+                if char != '{':
+                    continue
+                self.started = True
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._last_key = "".join(self._key_chars)
+                        self._key_chars = None
+                elif self._key_chars is not None:
+                    self._key_chars.append(char)
+                continue
+            
+            if char == '"':
+                self._in_string = True
+                # Only keys/values of the root object are captured, to spot "days"
+                self._key_chars = [] if self._depth == 1 else None
+            elif char in '{[':
+                if char == '[' and self._depth == 1 and self._last_key == "days":
+                    self._days_depth = 2
+                    self._saw_days = True
+                elif char == '{' and self._days_depth is not None and self._depth == self._days_depth:
+                    self._day_chunks = []
+                    day_start = i
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if char == '}' and self._day_chunks is not None and self._depth == self._days_depth:
+                    self._day_chunks.append(chunk[day_start:i + 1])
+                    day = self._decode_day("".join(self._day_chunks))
+                    if day is not None:
+                        completed.append(day)
+                    self._day_chunks = None
+                    day_start = None
+                elif char == ']' and self._depth == 1:
+                    self._days_depth = None
+                elif self._depth == 0:
+                    if self._saw_days:
+                        self.complete = True
+                        break
+                    # A braced aside in a preamble ("Here is {your} plan"); keep looking
+                    self.started = False
+                    self._last_key = None
+        
+        if self._day_chunks is not None and day_start is not None:
+            self._day_chunks.append(chunk[day_start:])
+        
+        self.days.extend(completed)
+        return completed
+    
+    def repair(self) -> Optional[dict]:
+        """Close a truncated response and return the day that was in progress.
+        
+        The day is kept only if the cut fell after its last meal's nutrition,
+        so every meal is fully formed; otherwise it is recorded in failed_days.
+        """
+        if self.complete or self._day_chunks is None:
+            return None
+        
+        text = repair_truncated_json("".join(self._day_chunks))
+        self._day_chunks = None
+        day = self._decode_day(text or "", require_nutrition=True)
+        if day is not None:
+            self.days.append(day)
+        return day
+    
+    def _decode_day(self, text: str, require_nutrition: bool = False) -> Optional[dict]:
+        self._day_index += 1
+        try:
+            day = json.loads(text)
+            if self.compact:
+                day = expand_compact_day(day)
+            missing = [meal_type for meal_type in self.meal_types if not isinstance(day.get(meal_type), dict)]
+            if missing:
+                raise ValueError(f"missing {', '.join(missing)}")
+            if require_nutrition:
+                for meal_type in self.meal_types:
+                    nutrition = day[meal_type].get("nutrition") or {}
+                    incomplete = [field for field in NUTRITION_FIELDS if field not in nutrition]
+                    if incomplete:
+                        raise ValueError(f"{meal_type} nutrition is missing {', '.join(incomplete)}")
+            return day
+        except (json.JSONDecodeError, ValueError, AttributeError, KeyError, TypeError) as day_error:
+            self.failed_days.append({"index": self._day_index, "error": str(day_error)})
+            return None
+
+COMPACT_MEAL_KEYS = {"b": "breakfast", "l": "lunch", "d": "dinner"}
+
+def expand_compact_day(day: dict) -> dict:
+    """Expand a compact day ({"day": 1, "b": [name, ingredients, instructions, nutrition], ...})
+    into the regular breakfast/lunch/dinner structure"""
+    expanded = {"day": day.get("day")}
+    for short_key, meal_type in COMPACT_MEAL_KEYS.items():
+        if short_key not in day:
+            continue
+        name, ingredients, instructions, nutrition = day[short_key]
+        if len(nutrition) != len(NUTRITION_FIELDS):
+            raise ValueError(f"{meal_type} nutrition has {len(nutrition)} values, expected {len(NUTRITION_FIELDS)}")
+        expanded[meal_type] = {
+            "name": name,
+            "recipe": {"ingredients": ingredients, "instructions": instructions},
+            "nutrition": dict(zip(NUTRITION_FIELDS, nutrition))
+        }
+    return expanded
@@ -1,22 +1,167 @@
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, ORJSONResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, ConfigDict, BeforeValidator, ValidationError
+from typing import Optional, List, Dict, Tuple, Annotated
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+from bson import ObjectId
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 import os
 import uuid
 from dotenv import load_dotenv
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import json
+import orjson
+import copy
+import numpy as np
+from meal_plan_parser import MEAL_TYPES, NUTRITION_FIELDS, COMPACT_MEAL_KEYS, MealPlanStreamParser
+import asyncio
+import random
+import re
+import time
+import hashlib
+import base64
+import sys
+import queue
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from contextlib import asynccontextmanager
+from abc import ABC, abstractmethod
+from collections import deque
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="NutriPlan API")
+# ============ Logging ============
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of DEBUG records (e.g. LLM response snippets) that are actually emitted
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 0.1))
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+STANDARD_LOG_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in STANDARD_LOG_ATTRS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the message and traceback apart.
+    
+    The stock prepare() formats the traceback into the message and clears
+    exc_info; here the traceback is rendered to exc_text so the listener's
+    JsonFormatter can emit it as its own field.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = (self.formatter or logging.Formatter()).formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request id and sample DEBUG records.
+    
+    Runs on the calling coroutine's side of the queue, where the request id
+    context variable is visible and dropped records cost nothing further.
+    """
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and random.random() >= LOG_DEBUG_SAMPLE_RATE:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Route records through a queue so the event loop never blocks on stdout.
+    
+    A background QueueListener thread formats and writes the records as JSON lines.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    
+    app_logger = logging.getLogger("nutriplan")
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.handlers = [queue_handler]
+    app_logger.propagate = False
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+log_listener = setup_logging()
+logger = logging.getLogger("nutriplan")
+
+# ============ JSON Responses ============
+
+def orjson_default(value):
+    """Types orjson does not serialize natively"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+class AppJSONResponse(ORJSONResponse):
+    """Default response class, serialized with orjson.
+    
+    orjson handles datetimes and numpy values itself and Mongo ObjectIds through
+    orjson_default. Endpoints returning large meal plans construct this response
+    directly, which also skips FastAPI's jsonable_encoder pass over the payload.
+    """
+    
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A briefly unreachable database must not keep the API from starting
+    try:
+        await ensure_indexes()
+    except PyMongoError:
+        logger.exception("Could not provision indexes; starting without them")
+    try:
+        await load_meal_library()
+    except PyMongoError:
+        logger.exception("Could not load the meal library; starting with it empty")
+    workers = start_generation_workers()
+    yield
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    log_listener.stop()
+
+app = FastAPI(title="NutriPlan API", lifespan=lifespan, default_response_class=AppJSONResponse)
 
 # CORS Configuration
 app.add_middleware(
@@ -27,6 +172,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_id_middleware(request, call_next):
+    """Correlate log records with the request via X-Request-ID"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # MongoDB setup
 MONGO_URL = os.getenv("MONGO_URL")
 DB_NAME = os.getenv("DB_NAME", "nutriplan_db")
@@ -44,6 +201,56 @@ security = HTTPBearer()
 
 # LLM Configuration
 EMERGENT_LLM_KEY = os.getenv("EMERGENT_LLM_KEY")
+# "emergent" calls the real model, "fake" uses the local stand-in for offline load tests
+LLM_BACKEND = os.getenv("LLM_BACKEND", "emergent")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "anthropic")
+LLM_MODEL = os.getenv("LLM_MODEL", "claude-sonnet-4-20250514")
+# Ask the model for short keys and positional nutrition arrays to cut output tokens
+LLM_COMPACT_SCHEMA = os.getenv("LLM_COMPACT_SCHEMA", "false").lower() == "true"
+# "single" asks for the whole week in one call, "parallel" fans out one call per day
+MEAL_PLAN_GENERATION_MODE = os.getenv("MEAL_PLAN_GENERATION_MODE", "single")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 7))
+LLM_DAY_RETRIES = int(os.getenv("LLM_DAY_RETRIES", 2))
+# Timeouts adapt to the rolling p95 of observed LLM latency, clamped to [min, max]
+LLM_TIMEOUT_DEFAULT_SECONDS = float(os.getenv("LLM_TIMEOUT_DEFAULT_SECONDS", 90))
+LLM_TIMEOUT_MIN_SECONDS = float(os.getenv("LLM_TIMEOUT_MIN_SECONDS", 10))
+LLM_TIMEOUT_MAX_SECONDS = float(os.getenv("LLM_TIMEOUT_MAX_SECONDS", 120))
+LLM_TIMEOUT_P95_MULTIPLIER = float(os.getenv("LLM_TIMEOUT_P95_MULTIPLIER", 2.0))
+# Hedging sends a second request once the primary exceeds the p95
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+# Hedges are only sent while fewer than this many LLM calls are in flight
+LLM_INFLIGHT_BUDGET = int(os.getenv("LLM_INFLIGHT_BUDGET", LLM_MAX_CONCURRENCY))
+# Circuit breaker: trip on error or slow-call rate over the last LLM_BREAKER_WINDOW calls
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", 20))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", 5))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", 0.5))
+LLM_BREAKER_SLOW_SECONDS = float(os.getenv("LLM_BREAKER_SLOW_SECONDS", 60))
+LLM_BREAKER_SLOW_RATE = float(os.getenv("LLM_BREAKER_SLOW_RATE", 0.5))
+LLM_BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", 30))
+# Compose plans from previously generated meals before calling the LLM
+MEAL_LIBRARY_FIRST = os.getenv("MEAL_LIBRARY_FIRST", "false").lower() == "true"
+MEAL_LIBRARY_MAX_SIZE = int(os.getenv("MEAL_LIBRARY_MAX_SIZE", 100000))
+MEAL_LIBRARY_CALORIE_TOLERANCE = float(os.getenv("MEAL_LIBRARY_CALORIE_TOLERANCE", 0.10))
+MEAL_LIBRARY_PROTEIN_TOLERANCE = float(os.getenv("MEAL_LIBRARY_PROTEIN_TOLERANCE", 0.15))
+MEAL_LIBRARY_FIBER_TOLERANCE = float(os.getenv("MEAL_LIBRARY_FIBER_TOLERANCE", 0.25))
+
+# Meal plan cache configuration
+MEAL_PLAN_CACHE_TTL_SECONDS = int(os.getenv("MEAL_PLAN_CACHE_TTL_SECONDS", 604800))
+# Approximate reuse: profiles in the same calorie/protein band share cached plans
+PLAN_REUSE_ENABLED = os.getenv("PLAN_REUSE_ENABLED", "true").lower() == "true"
+PLAN_REUSE_CALORIE_BAND = int(os.getenv("PLAN_REUSE_CALORIE_BAND", 100))
+PLAN_REUSE_PROTEIN_BAND = int(os.getenv("PLAN_REUSE_PROTEIN_BAND", 10))
+
+# Single-flight generation leases shared across workers
+GENERATION_LEASE_SECONDS = int(os.getenv("GENERATION_LEASE_SECONDS", 180))
+GENERATION_RESULT_GRACE_SECONDS = int(os.getenv("GENERATION_RESULT_GRACE_SECONDS", 10))
+GENERATION_LEASE_POLL_SECONDS = float(os.getenv("GENERATION_LEASE_POLL_SECONDS", 0.5))
+
+# Background generation job queue
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", 2))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 120))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
 
 # ============ Pydantic Models ============
 
@@ -77,6 +284,49 @@ class UpdateMealRequest(BaseModel):
     meal_type: str  # breakfast, lunch, dinner
     dining_out: bool
 
+class DiningOutChange(BaseModel):
+    day: int  # 1-7
+    meal_type: str  # breakfast, lunch, dinner
+    dining_out: bool
+
+class BulkDiningOutRequest(BaseModel):
+    changes: List[DiningOutChange]
+
+class RegenerateMealRequest(BaseModel):
+    day: int  # 1-7
+    meal_type: Optional[str] = None  # breakfast, lunch, dinner; omit to regenerate the whole day
+
+def coerce_number(value):
+    """Accept numbers the LLM wrote as text with units, e.g. "350 kcal" or "1,200" """
+    if isinstance(value, str):
+        match = re.search(r"-?\d+(?:\.\d+)?", value.replace(",", ""))
+        if match is None:
+            raise ValueError(f"no number in {value!r}")
+        return float(match.group())
+    return value
+
+NutritionValue = Annotated[float, BeforeValidator(coerce_number), Field(ge=0)]
+
+class MealNutrition(BaseModel):
+    calories: NutritionValue
+    protein: NutritionValue
+    carbs: NutritionValue
+    fat: NutritionValue
+    fiber: NutritionValue
+    sugar: NutritionValue
+
+class MealRecipe(BaseModel):
+    ingredients: List[str] = Field(min_length=1)
+    instructions: List[str] = Field(min_length=1)
+
+class PlannedMeal(BaseModel):
+    """One meal slot of a generated plan; extra keys such as dining_out are kept"""
+    model_config = ConfigDict(extra="allow")
+    
+    name: str = Field(min_length=1)
+    recipe: MealRecipe
+    nutrition: MealNutrition
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
@@ -96,6 +346,9 @@ def create_access_token(data: dict) -> str:
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+# The principal handed to endpoints; the password hash never leaves login
+USER_PRINCIPAL_PROJECTION = {"_id": 0, "user_id": 1, "username": 1, "profile": 1}
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
@@ -103,29 +356,739 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid authentication token")
-        user = await db.users.find_one({"user_id": user_id})
+        user = await db.users.find_one({"user_id": user_id}, USER_PRINCIPAL_PROJECTION)
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
         return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
 
-# ============ AI Meal Plan Generation ============
+# ============ LLM Backends ============
 
-async def generate_meal_plan_with_ai(profile: dict) -> dict:
-    """Generate a 7-day meal plan using Claude Sonnet-4"""
+class LLMBackend(ABC):
+    """Interface for the model that turns meal plan prompts into JSON text"""
     
-    # Build a simplified prompt for more reliable JSON generation
-    prompt = f"""Create a 7-day meal plan JSON for:
-- Gender: {profile.get('gender', 'male')}
+    model_name = "unknown"
+    
+    @abstractmethod
+    async def send_prompt(self, prompt: str, system_message: str) -> str:
+        """Send one prompt and return the raw response text"""
+
+class EmergentLLMBackend(LLMBackend):
+    """The production backend: Claude through the Emergent integrations client"""
+    
+    def __init__(self, api_key: str, provider: str, model: str):
+        self.api_key = api_key
+        self.provider = provider
+        self.model_name = model
+    
+    async def send_prompt(self, prompt: str, system_message: str) -> str:
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=f"meal-plan-{uuid.uuid4()}",
+            system_message=system_message
+        ).with_model(self.provider, self.model_name)
+        
+        user_message = UserMessage(text=prompt)
+        return await chat.send_message(user_message)
+
+# (name, ingredients, instructions, [calories, protein, carbs, fat, fiber, sugar], vegetarian)
+FAKE_MEAL_CATALOG = {
+    "breakfast": [
+        ("Oatmeal Bowl", ["1 cup oats", "1 cup milk", "1 banana"], ["Cook oats with milk", "Top with banana"], [350, 12, 60, 8, 6, 15], True),
+        ("Greek Yogurt Parfait", ["200g greek yogurt", "1/2 cup granola", "1/2 cup berries"], ["Layer yogurt and granola", "Top with berries"], [320, 22, 40, 8, 5, 18], True),
+        ("Veggie Omelette", ["3 eggs", "1/2 cup spinach", "1/4 cup peppers"], ["Whisk eggs", "Cook with vegetables"], [300, 21, 6, 20, 2, 3], True),
+        ("Turkey Breakfast Wrap", ["1 tortilla", "80g turkey", "1 egg"], ["Scramble egg", "Wrap with turkey"], [380, 30, 30, 14, 3, 2], False),
+    ],
+    "lunch": [
+        ("Chicken Salad", ["150g chicken", "2 cups lettuce", "1 tbsp olive oil"], ["Grill chicken", "Toss with lettuce and oil"], [400, 35, 10, 20, 4, 5], False),
+        ("Lentil Soup", ["1 cup lentils", "1 carrot", "1 onion"], ["Simmer lentils with vegetables"], [380, 24, 55, 6, 15, 6], True),
+        ("Quinoa Buddha Bowl", ["1 cup quinoa", "1/2 cup chickpeas", "1 cup vegetables"], ["Cook quinoa", "Top with chickpeas and vegetables"], [450, 18, 65, 12, 11, 7], True),
+        ("Tuna Sandwich", ["2 slices wholegrain bread", "1 can tuna", "1 tbsp mayo"], ["Mix tuna and mayo", "Assemble sandwich"], [420, 32, 35, 15, 5, 4], False),
+    ],
+    "dinner": [
+        ("Salmon with Rice", ["150g salmon", "1 cup rice", "1 cup broccoli"], ["Bake salmon", "Serve with rice and broccoli"], [550, 38, 55, 18, 4, 2], False),
+        ("Tofu Stir Fry", ["200g tofu", "1 cup vegetables", "1 cup rice"], ["Stir fry tofu and vegetables", "Serve over rice"], [480, 25, 60, 14, 6, 8], True),
+        ("Bean Chili", ["1 cup kidney beans", "1 cup tomatoes", "1 onion"], ["Simmer all ingredients"], [430, 22, 65, 6, 18, 9], True),
+        ("Beef Stir Fry", ["150g beef", "1 cup vegetables", "1 cup noodles"], ["Stir fry beef", "Add vegetables and noodles"], [580, 40, 50, 22, 5, 6], False),
+    ],
+}
+
+class FakeLLMBackend(LLMBackend):
+    """Deterministic local stand-in that returns schema-valid meal plans.
+    
+    Latency is log-normal around latency_ms plus output tokens at tokens_per_second,
+    and a configurable fraction of responses are truncated or malformed so parsing
+    and fallback paths are exercised under load.
+    """
+    
+    model_name = "fake-llm"
+    
+    def __init__(self, latency_ms: float = 800, latency_sigma: float = 0.3, tokens_per_second: float = 0,
+                 truncation_rate: float = 0.0, malformed_rate: float = 0.0, seed: int = 42):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.truncation_rate = truncation_rate
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.calls = 0
+    
+    def build_day(self, rng: random.Random, day: int, vegetarian: bool, calorie_target: float) -> dict:
+        day_data = {"day": day}
+        meals = {}
+        for meal_type in MEAL_TYPES:
+            options = [meal for meal in FAKE_MEAL_CATALOG[meal_type] if meal[4] or not vegetarian]
+            meals[meal_type] = options[(day + rng.randrange(len(options))) % len(options)]
+        scale = calorie_target / sum(meal[3][0] for meal in meals.values())
+        for meal_type, (name, ingredients, instructions, nutrition, _) in meals.items():
+            day_data[meal_type] = {
+                "name": name,
+                "recipe": {"ingredients": list(ingredients), "instructions": list(instructions)},
+                "nutrition": dict(zip(NUTRITION_FIELDS, (round(value * scale) for value in nutrition)))
+            }
+        return day_data
+    
+    def build_response(self, rng: random.Random, prompt: str) -> str:
+        day_match = re.search(r"Create day (\d+) of", prompt)
+        days = [int(day_match.group(1))] if day_match else list(range(1, 8))
+        calorie_match = re.search(r"Calories: (\d+)", prompt)
+        calorie_target = float(calorie_match.group(1)) if calorie_match else 2000.0
+        restrictions = re.search(r"Dietary restrictions: (.*)", prompt)
+        vegetarian = bool(restrictions and re.search(r"vegetarian|vegan", restrictions.group(1), re.IGNORECASE))
+        
+        meal_match = re.search(r"Create a new (breakfast|lunch|dinner) for day (\d+)", prompt)
+        if meal_match:
+            days = [int(meal_match.group(2))]
+        
+        plan = {"days": [self.build_day(rng, day, vegetarian, calorie_target) for day in days]}
+        if meal_match:
+            plan["days"][0] = {"day": days[0], meal_match.group(1): plan["days"][0][meal_match.group(1)]}
+        if "compact positional format" in prompt:
+            return json.dumps({"days": [compact_day(day) for day in plan["days"]]}, separators=(",", ":"))
+        return json.dumps(plan, indent=2)
+    
+    async def send_prompt(self, prompt: str, system_message: str) -> str:
+        self.calls += 1
+        rng = random.Random(self.seed * 1000003 + self.calls)
+        text = self.build_response(rng, prompt)
+        
+        roll = rng.random()
+        if roll < self.truncation_rate:
+            text = text[:rng.randrange(len(text) // 4, len(text))]
+        elif roll < self.truncation_rate + self.malformed_rate:
+            position = rng.randrange(len(text) // 4, len(text))
+            position = text.find(",", position)
+            if position != -1:
+                text = text[:position] + ";" + text[position + 1:]
+        
+        delay = rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+        if self.tokens_per_second > 0:
+            delay += (len(text) / 4) / self.tokens_per_second
+        await asyncio.sleep(delay)
+        return text
+
+def compact_day(day: dict) -> dict:
+    """Inverse of expand_compact_day"""
+    compact = {"day": day["day"]}
+    for short_key, meal_type in COMPACT_MEAL_KEYS.items():
+        if meal_type not in day:
+            continue
+        meal = day[meal_type]
+        compact[short_key] = [
+            meal["name"],
+            meal["recipe"]["ingredients"],
+            meal["recipe"]["instructions"],
+            [meal["nutrition"][field] for field in NUTRITION_FIELDS]
+        ]
+    return compact
+
+def create_llm_backend() -> LLMBackend:
+    if LLM_BACKEND == "fake":
+        return FakeLLMBackend(
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", 800)),
+            latency_sigma=float(os.getenv("FAKE_LLM_LATENCY_SIGMA", 0.3)),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", 0)),
+            truncation_rate=float(os.getenv("FAKE_LLM_TRUNCATION_RATE", 0)),
+            malformed_rate=float(os.getenv("FAKE_LLM_MALFORMED_RATE", 0)),
+            seed=int(os.getenv("FAKE_LLM_SEED", 42))
+        )
+    if LLM_BACKEND != "emergent":
+        raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND}")
+    return EmergentLLMBackend(EMERGENT_LLM_KEY, LLM_PROVIDER, LLM_MODEL)
+
+class LLMConcurrencyLimiter:
+    """Bounds concurrent LLM calls to `size` slots shared by all requests.
+    
+    The time spent waiting for a free slot is recorded in `metrics`.
+    """
+    
+    def __init__(self, size: int):
+        self.size = size
+        self._semaphore = asyncio.Semaphore(size)
+        self.metrics = {"acquisitions": 0, "waiting": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+    
+    @asynccontextmanager
+    async def slot(self):
+        started = time.perf_counter()
+        self.metrics["waiting"] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.metrics["waiting"] -= 1
+        
+        waited = time.perf_counter() - started
+        self.metrics["acquisitions"] += 1
+        self.metrics["wait_seconds_total"] += waited
+        self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], waited)
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+llm_backend = create_llm_backend()
+llm_limiter = LLMConcurrencyLimiter(LLM_MAX_CONCURRENCY)
+
+# ============ AI Meal Plan Generation ============
+
+LLM_SYSTEM_MESSAGE = "You are a nutritionist. Return only valid JSON meal plans with no additional text or formatting."
+
+def build_profile_summary(profile: dict) -> str:
+    """Render the profile lines shared by every meal plan prompt"""
+    return f"""- Gender: {profile.get('gender', 'male')}
 - Age: {profile.get('age', 30)}
 - Weight: {profile.get('weight', 70)} kg
 - Activity: {profile.get('activity_level', 'moderately_active')}
 - Goal: {profile.get('fitness_goal', 'maintain_weight')}
 - Calories: {profile.get('calorie_target', 2000)}/day
 - Protein: {profile.get('protein_target', 100)}g/day
-- Dietary restrictions: {', '.join(profile.get('dietary_restrictions', [])) or 'None'}
+- Dietary restrictions: {', '.join(profile.get('dietary_restrictions', [])) or 'None'}"""
+
+# Per-day themes keep parallel days varied when they cannot see each other
+DAY_THEMES = [
+    "Mediterranean",
+    "Asian-inspired",
+    "Mexican-inspired",
+    "American classics",
+    "Middle Eastern",
+    "Italian-inspired",
+    "Indian-inspired",
+]
+
+def build_compact_format(day: int) -> str:
+    """Output instructions for the compact wire schema (see expand_compact_day)"""
+    return f"""Return ONLY minified JSON in this compact positional format (no extra text, no whitespace):
+{{"days":[{{"day":{day},"b":["Oatmeal Bowl",["1 cup oats","1 cup milk","1 banana"],["Cook oats","Add milk","Top with banana"],[350,12,60,8,6,15]],"l":[...],"d":[...]}}]}}
+
+b, l and d are breakfast, lunch and dinner. Each meal is
+[name, ingredients, instructions, [calories, protein, carbs, fat, fiber, sugar]].
+"""
+
+def build_day_prompt(profile: dict, day: int, previous_meals: Optional[List[str]] = None, theme: Optional[str] = None, compact: bool = False) -> str:
+    """Build a prompt asking for a single day of the meal plan"""
+    avoid = ', '.join(previous_meals or []) or 'None'
+    theme_line = f"\nTheme for this day: {theme}\n" if theme else ""
+    header = f"""Create day {day} of a 7-day meal plan JSON for:
+{build_profile_summary(profile)}
+{theme_line}
+Meals already planned this week (do not repeat): {avoid}
+"""
+    if compact:
+        return f"{header}\n{build_compact_format(day)}"
+    
+    return f"""{header}
+Return ONLY valid JSON for this one day in this exact format (no extra text):
+{{
+  "days": [
+    {{
+      "day": {day},
+      "breakfast": {{
+        "name": "Oatmeal Bowl",
+        "recipe": {{
+          "ingredients": ["1 cup oats", "1 cup milk", "1 banana"],
+          "instructions": ["Cook oats", "Add milk", "Top with banana"]
+        }},
+        "nutrition": {{"calories": 350, "protein": 12, "carbs": 60, "fat": 8, "fiber": 6, "sugar": 15}}
+      }},
+      "lunch": {{ ...same structure... }},
+      "dinner": {{ ...same structure... }}
+    }}
+  ]
+}}
+
+Ensure valid JSON syntax."""
+
+class LatencyTracker:
+    """Rolling window of LLM call latencies used for adaptive timeouts and hedging.
+    
+    Keep one tracker per prompt kind: a week prompt takes several times longer
+    than a day or meal prompt, so a shared window would time week calls out.
+    """
+    
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+    
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+    
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Latency at the given fraction, or None until enough samples are collected"""
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    
+    def timeout(self) -> float:
+        p95 = self.percentile(0.95)
+        if p95 is None:
+            return LLM_TIMEOUT_DEFAULT_SECONDS
+        return min(LLM_TIMEOUT_MAX_SECONDS, max(LLM_TIMEOUT_MIN_SECONDS, p95 * LLM_TIMEOUT_P95_MULTIPLIER))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a window of recent LLM call outcomes.
+    
+    Opens when the error rate or slow-call rate in the window crosses its threshold.
+    After LLM_BREAKER_OPEN_SECONDS a single probe call is let through (half-open);
+    its outcome closes the breaker or opens it again.
+    """
+    
+    def __init__(self):
+        self.state = "closed"
+        self.outcomes = deque(maxlen=LLM_BREAKER_WINDOW)
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.trips = 0
+        self.short_circuits = 0
+    
+    def allow_request(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= LLM_BREAKER_OPEN_SECONDS:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.short_circuits += 1
+        return False
+    
+    def record(self, ok: bool, seconds: float):
+        if self.state == "half_open":
+            self.probe_in_flight = False
+            if ok and seconds < LLM_BREAKER_SLOW_SECONDS:
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self.trip()
+            return
+        
+        self.outcomes.append((ok, seconds >= LLM_BREAKER_SLOW_SECONDS))
+        if self.state == "closed" and len(self.outcomes) >= LLM_BREAKER_MIN_CALLS:
+            errors = sum(1 for ok, _ in self.outcomes if not ok)
+            slow = sum(1 for _, is_slow in self.outcomes if is_slow)
+            if errors / len(self.outcomes) >= LLM_BREAKER_ERROR_RATE or slow / len(self.outcomes) >= LLM_BREAKER_SLOW_RATE:
+                self.trip()
+    
+    def release(self):
+        """Forget a call that ended without an outcome, e.g. because its caller went away"""
+        if self.state == "half_open":
+            self.probe_in_flight = False
+    
+    def trip(self):
+        logger.warning("LLM circuit breaker opened", extra={"previous_state": self.state})
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        self.trips += 1
+
+LLM_PROMPT_KINDS = ("week", "day", "meal")
+
+llm_latency = {kind: LatencyTracker() for kind in LLM_PROMPT_KINDS}
+llm_breaker = CircuitBreaker()
 
+# ============ LLM Instrumentation ============
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds", "Time spent waiting for an LLM concurrency slot",
+    ["prompt_variant"], buckets=LATENCY_BUCKETS
+)
+LLM_LATENCY = Histogram(
+    "llm_request_latency_seconds", "Total LLM call latency including queueing, hedging and timeouts",
+    ["model", "prompt_variant", "status"], buckets=LATENCY_BUCKETS
+)
+LLM_INPUT_TOKENS = Counter("llm_input_tokens_total", "Estimated prompt tokens sent", ["model", "prompt_variant"])
+LLM_OUTPUT_TOKENS = Counter("llm_output_tokens_total", "Estimated completion tokens received", ["model", "prompt_variant"])
+LLM_RESPONSE_BYTES = Histogram(
+    "llm_response_bytes", "Size of LLM responses in bytes",
+    ["model", "prompt_variant"], buckets=(256, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+)
+LLM_PARSE_OUTCOMES = Counter(
+    "llm_parse_outcomes_total", "Parse outcome of LLM responses (ok, repaired, invalid, fallback, error)",
+    ["model", "prompt_variant", "outcome"]
+)
+LLM_RETRIES = Counter("llm_retries_total", "LLM calls retried after a failed or unusable response", ["model", "prompt_variant"])
+LLM_TRUNCATED_DAYS = Counter(
+    "llm_truncated_days_total", "Days missing from truncated week responses, by how they were recovered (repaired, regenerated, fallback)",
+    ["model", "prompt_variant", "recovery"]
+)
+LLM_INVALID_MEALS = Counter(
+    "llm_invalid_meals_total", "Meal slots that failed plan validation, by how they were recovered (regenerated, fallback)",
+    ["model", "recovery"]
+)
+
+def prompt_variant(kind: str) -> str:
+    """Metric label for a prompt: week, day or meal, plus the wire schema"""
+    return f"{kind}-compact" if LLM_COMPACT_SCHEMA else kind
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); the LLM client does not report usage"""
+    return max(1, len(text) // 4)
+
+def record_parse_outcome(kind: str, outcome: str):
+    LLM_PARSE_OUTCOMES.labels(llm_backend.model_name, prompt_variant(kind), outcome).inc()
+
+llm_metrics = {"calls": 0, "inflight": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0, "hedges_skipped": 0}
+
+async def send_llm_prompt_once(prompt: str, kind: str = "week") -> str:
+    variant = prompt_variant(kind)
+    llm_metrics["inflight"] += 1
+    queued = time.perf_counter()
+    try:
+        async with llm_limiter.slot():
+            started = time.perf_counter()
+            LLM_QUEUE_WAIT.labels(variant).observe(started - queued)
+            response = await llm_backend.send_prompt(prompt, LLM_SYSTEM_MESSAGE)
+            llm_latency[kind].record(time.perf_counter() - started)
+            return response
+    finally:
+        llm_metrics["inflight"] -= 1
+
+def is_valid_llm_response(response: str, meal_types: Optional[List[str]] = None) -> bool:
+    """Whether the response parses completely; meal_types are the meals each day must have"""
+    parser = MealPlanStreamParser(compact=LLM_COMPACT_SCHEMA, meal_types=meal_types)
+    parser.feed(response)
+    return parser.complete and bool(parser.days) and not parser.failed_days
+
+async def send_hedged_llm_prompt(prompt: str, kind: str = "week", meal_types: Optional[List[str]] = None) -> str:
+    """Send the prompt, hedging with a second request once the primary exceeds its kind's p95.
+    
+    The first valid response wins and the other request is cancelled; meal_types
+    are the meals a valid response must contain (all of them by default). Hedges are
+    skipped while LLM_INFLIGHT_BUDGET calls are already in flight so an upstream
+    outage is not amplified.
+    """
+    tasks = [asyncio.create_task(send_llm_prompt_once(prompt, kind))]
+    try:
+        hedge_delay = llm_latency[kind].percentile(0.95)
+        if hedge_delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                if llm_metrics["inflight"] < LLM_INFLIGHT_BUDGET:
+                    llm_metrics["hedges"] += 1
+                    tasks.append(asyncio.create_task(send_llm_prompt_once(prompt, kind)))
+                else:
+                    llm_metrics["hedges_skipped"] += 1
+        
+        pending = set(tasks)
+        first_result = None
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    continue
+                if is_valid_llm_response(task.result(), meal_types):
+                    if task is not tasks[0]:
+                        llm_metrics["hedge_wins"] += 1
+                    return task.result()
+                if first_result is None:
+                    first_result = task.result()
+        
+        if first_result is not None:
+            return first_result
+        raise last_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def send_llm_prompt(prompt: str, kind: str = "week", meal_types: Optional[List[str]] = None) -> str:
+    """Send a prompt to the LLM within a concurrency slot and return the raw response text.
+    
+    The call is bounded by an adaptive timeout derived from recent latencies of the
+    same kind (week, day or meal) and raises CircuitOpenError without calling the
+    LLM while the breaker is open. kind also labels the call's metrics, and meal_types lists the
+    meals the prompt asks for, which a hedged response must contain to win.
+    """
+    variant = prompt_variant(kind)
+    model = llm_backend.model_name
+    if not llm_breaker.allow_request():
+        LLM_LATENCY.labels(model, variant, "short_circuit").observe(0)
+        raise CircuitOpenError("LLM circuit breaker is open")
+    
+    llm_metrics["calls"] += 1
+    LLM_INPUT_TOKENS.labels(model, variant).inc(estimate_tokens(LLM_SYSTEM_MESSAGE) + estimate_tokens(prompt))
+    timeout = llm_latency[kind].timeout()
+    send = send_hedged_llm_prompt(prompt, kind, meal_types) if LLM_HEDGING_ENABLED else send_llm_prompt_once(prompt, kind)
+    started = time.perf_counter()
+    try:
+        response = await asyncio.wait_for(send, timeout)
+    except asyncio.TimeoutError:
+        llm_metrics["timeouts"] += 1
+        LLM_LATENCY.labels(model, variant, "timeout").observe(time.perf_counter() - started)
+        # Not a latency sample: feeding timeouts back into the p95 ratchets the timeout
+        # up to its maximum; a persistently slow upstream is the breaker's job
+        llm_breaker.record(False, timeout)
+        raise asyncio.TimeoutError(f"LLM call timed out after {timeout:.1f}s")
+    except asyncio.CancelledError:
+        # The caller went away (e.g. an SSE client disconnected); says nothing about the LLM
+        LLM_LATENCY.labels(model, variant, "cancelled").observe(time.perf_counter() - started)
+        llm_breaker.release()
+        raise
+    except Exception:
+        elapsed = time.perf_counter() - started
+        LLM_LATENCY.labels(model, variant, "error").observe(elapsed)
+        llm_breaker.record(False, elapsed)
+        raise
+    
+    elapsed = time.perf_counter() - started
+    llm_breaker.record(True, elapsed)
+    LLM_LATENCY.labels(model, variant, "ok").observe(elapsed)
+    LLM_OUTPUT_TOKENS.labels(model, variant).inc(estimate_tokens(response))
+    LLM_RESPONSE_BYTES.labels(model, variant).observe(len(response.encode("utf-8")))
+    return response
+
+# ============ Meal Plan Validation ============
+
+def validate_meal(meal) -> Tuple[Optional[dict], List[dict]]:
+    """Validate one meal slot, returning the normalized meal or the list of its errors"""
+    try:
+        return PlannedMeal.model_validate(meal).model_dump(), []
+    except ValidationError as e:
+        return None, [
+            {"loc": ".".join(str(part) for part in error["loc"]), "msg": error["msg"]}
+            for error in e.errors(include_url=False)
+        ]
+
+def validate_meal_plan(meal_plan_data: dict) -> Tuple[dict, List[dict]]:
+    """Validate every meal slot of a plan.
+    
+    Returns a copy of the plan with numbers coerced and day numbers set, and one
+    {"day", "meal_type", "errors"} entry per invalid slot. Invalid slots are left
+    as they were so they can be regenerated individually.
+    """
+    days = []
+    invalid = []
+    for position, day in enumerate(meal_plan_data.get("days", []), start=1):
+        day_number = day.get("day") if isinstance(day.get("day"), int) else position
+        validated = {**day, "day": day_number}
+        for meal_type in MEAL_TYPES:
+            meal, errors = validate_meal(day.get(meal_type))
+            if meal is None:
+                invalid.append({"day": day_number, "meal_type": meal_type, "errors": errors})
+            else:
+                validated[meal_type] = meal
+        days.append(validated)
+    return {**meal_plan_data, "days": days}, invalid
+
+async def validate_and_repair_meal_plan(profile: dict, meal_plan_data: dict, week_meals: Optional[List[str]] = None) -> dict:
+    """Validate a generated plan and regenerate only its invalid meal slots.
+    
+    Invalid slots are regenerated concurrently with generate_meal_with_ai; a slot
+    that still fails gets the fallback meal and its day is flagged as fallback.
+    """
+    meal_plan_data, invalid = validate_meal_plan(meal_plan_data)
+    if not invalid:
+        return meal_plan_data
+    
+    logger.warning("Generated meal plan has invalid meals", extra={"invalid": invalid})
+    invalid_slots = {(slot["day"], slot["meal_type"]) for slot in invalid}
+    week_meals = list(week_meals or []) + [
+        day[meal_type]["name"]
+        for day in meal_plan_data["days"]
+        for meal_type in MEAL_TYPES
+        if (day["day"], meal_type) not in invalid_slots
+    ]
+    results = await asyncio.gather(
+        *(generate_meal_with_ai(profile, slot["day"], slot["meal_type"], week_meals) for slot in invalid),
+        return_exceptions=True
+    )
+    
+    days_by_number = {day["day"]: day for day in meal_plan_data["days"]}
+    for slot, meal in zip(invalid, results):
+        day = days_by_number[slot["day"]]
+        if isinstance(meal, Exception) or meal is None:
+            meal = build_fallback_day(slot["day"], profile)[slot["meal_type"]]
+            day["fallback"] = True
+            recovery = "fallback"
+        else:
+            recovery = "regenerated"
+        day[slot["meal_type"]] = meal
+        LLM_INVALID_MEALS.labels(llm_backend.model_name, recovery).inc()
+    return meal_plan_data
+
+# ============ Fallback Meal Plans ============
+
+# (name, ingredients, instructions, [calories, protein, carbs, fat, fiber, sugar], diets, allergens)
+FALLBACK_MEALS = {
+    "breakfast": [
+        ("Oatmeal Bowl", ["1 cup oats", "1 cup milk", "1 banana"], ["Cook oats with milk", "Top with sliced banana"],
+         [350, 12, 60, 8, 6, 15], {"vegetarian", "pescatarian"}, {"dairy", "gluten"}),
+        ("Chia Pudding with Berries", ["3 tbsp chia seeds", "1 cup coconut milk", "1/2 cup berries"], ["Stir chia into coconut milk", "Chill overnight", "Top with berries"],
+         [330, 9, 32, 19, 13, 12], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, set()),
+        ("Veggie Omelette", ["3 eggs", "1/2 cup spinach", "1/4 cup peppers", "1 tsp olive oil"], ["Whisk eggs", "Cook with vegetables in olive oil"],
+         [300, 21, 6, 20, 2, 3], {"vegetarian", "pescatarian", "gluten_free", "dairy_free"}, {"eggs"}),
+        ("Greek Yogurt Parfait", ["200g greek yogurt", "1/2 cup granola", "1/2 cup berries"], ["Layer yogurt and granola", "Top with berries"],
+         [320, 22, 40, 8, 5, 18], {"vegetarian", "pescatarian"}, {"dairy", "gluten", "nuts"}),
+        ("Tofu Scramble on Toast", ["150g firm tofu", "1 cup spinach", "1 tomato", "1 slice wholegrain toast"], ["Crumble and fry tofu", "Wilt spinach and tomato", "Serve on toast"],
+         [340, 22, 28, 15, 6, 4], {"vegan", "vegetarian", "pescatarian", "dairy_free"}, {"soy", "gluten"}),
+        ("Smoked Salmon Rice Cakes", ["2 rice cakes", "60g smoked salmon", "1/2 avocado"], ["Mash avocado onto rice cakes", "Top with salmon"],
+         [310, 20, 24, 14, 5, 1], {"pescatarian", "gluten_free", "dairy_free"}, {"fish"}),
+        ("Turkey Sweet Potato Hash", ["100g ground turkey", "1 sweet potato", "1/2 onion", "1 tsp olive oil"], ["Dice and fry sweet potato", "Add turkey and onion", "Cook through"],
+         [380, 28, 30, 15, 5, 7], {"gluten_free", "dairy_free"}, set()),
+        ("Quinoa Apple Porridge", ["1/2 cup quinoa", "1 cup coconut milk", "1 apple", "1 tsp cinnamon"], ["Simmer quinoa in coconut milk", "Stir in diced apple and cinnamon"],
+         [360, 10, 52, 13, 7, 16], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, set()),
+        ("Sweet Potato Breakfast Bowl", ["1 baked sweet potato", "1/2 cup coconut yogurt", "1/2 cup berries", "1 tbsp pumpkin seeds"], ["Split the sweet potato", "Top with yogurt, berries and seeds"],
+         [340, 8, 58, 9, 9, 20], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, set()),
+    ],
+    "lunch": [
+        ("Grilled Chicken Salad", ["150g chicken breast", "2 cups lettuce", "1 tbsp olive oil"], ["Grill chicken", "Toss with lettuce and olive oil"],
+         [400, 35, 10, 20, 4, 5], {"gluten_free", "dairy_free"}, set()),
+        ("Lentil Soup", ["1 cup lentils", "1 carrot", "1 onion", "3 cups vegetable stock"], ["Saute vegetables", "Simmer with lentils and stock"],
+         [380, 24, 55, 6, 15, 6], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, set()),
+        ("Quinoa Buddha Bowl", ["1 cup quinoa", "1/2 cup chickpeas", "1 cup roasted vegetables", "1 tbsp tahini"], ["Cook quinoa", "Top with chickpeas and vegetables", "Drizzle with tahini"],
+         [450, 18, 65, 12, 11, 7], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, {"sesame"}),
+        ("Tuna Wholewheat Wrap", ["1 wholewheat tortilla", "1 can tuna", "1 tbsp mayonnaise", "1 cup lettuce"], ["Mix tuna and mayonnaise", "Wrap with lettuce"],
+         [420, 32, 35, 15, 5, 4], {"pescatarian", "dairy_free"}, {"fish", "gluten", "eggs"}),
+        ("Caprese Pasta Salad", ["1 cup wholewheat pasta", "60g mozzarella", "1 cup cherry tomatoes", "fresh basil"], ["Cook and cool pasta", "Toss with mozzarella, tomatoes and basil"],
+         [460, 18, 58, 17, 4, 6], {"vegetarian", "pescatarian"}, {"dairy", "gluten"}),
+        ("Black Bean Burrito Bowl", ["1/2 cup brown rice", "1 cup black beans", "1/2 cup corn", "1/4 cup salsa"], ["Cook rice", "Warm beans and corn", "Top with salsa"],
+         [470, 17, 80, 8, 16, 6], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, set()),
+        ("Turkey Avocado Sandwich", ["2 slices wholegrain bread", "100g turkey breast", "1/2 avocado", "lettuce"], ["Mash avocado on bread", "Layer turkey and lettuce"],
+         [440, 30, 38, 17, 7, 5], {"dairy_free"}, {"gluten"}),
+    ],
+    "dinner": [
+        ("Salmon with Rice and Broccoli", ["150g salmon", "1 cup rice", "1 cup broccoli"], ["Bake salmon", "Cook rice", "Steam broccoli"],
+         [550, 38, 55, 18, 4, 2], {"pescatarian", "gluten_free", "dairy_free"}, {"fish"}),
+        ("Tofu Vegetable Stir Fry", ["200g tofu", "2 cups mixed vegetables", "1 cup rice", "1 tbsp soy sauce"], ["Stir fry tofu and vegetables", "Season with soy sauce", "Serve over rice"],
+         [480, 25, 60, 14, 6, 8], {"vegan", "vegetarian", "pescatarian", "dairy_free"}, {"soy", "gluten"}),
+        ("Chickpea Sweet Potato Curry", ["1 cup chickpeas", "1 sweet potato", "1/2 cup coconut milk", "1/2 cup rice"], ["Simmer chickpeas and sweet potato in coconut milk with spices", "Serve with rice"],
+         [520, 16, 78, 16, 14, 10], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, set()),
+        ("Chicken Rice Bowl", ["150g chicken thigh", "1 cup rice", "1 cup vegetables", "1 tbsp olive oil"], ["Grill chicken", "Cook rice", "Saute vegetables and combine"],
+         [500, 38, 60, 12, 5, 6], {"gluten_free", "dairy_free"}, set()),
+        ("Garlic Shrimp Zucchini Noodles", ["150g shrimp", "2 zucchini", "2 cloves garlic", "1 tbsp olive oil"], ["Spiralize zucchini", "Saute shrimp with garlic", "Toss with noodles"],
+         [380, 30, 18, 20, 5, 8], {"pescatarian", "gluten_free", "dairy_free"}, {"shellfish"}),
+        ("Three Bean Chili", ["1 cup mixed beans", "1 cup crushed tomatoes", "1 onion", "1 bell pepper"], ["Saute onion and pepper", "Simmer with beans and tomatoes"],
+         [430, 22, 65, 6, 18, 9], {"vegan", "vegetarian", "pescatarian", "gluten_free", "dairy_free"}, set()),
+        ("Ricotta Stuffed Peppers", ["2 bell peppers", "100g ricotta", "1 egg", "1 cup spinach"], ["Mix ricotta, egg and spinach", "Stuff peppers and bake"],
+         [450, 24, 35, 22, 7, 10], {"vegetarian", "pescatarian", "gluten_free"}, {"dairy", "eggs"}),
+    ],
+}
+
+DIET_ALIASES = {
+    "vegetarian": "vegetarian",
+    "vegan": "vegan",
+    "pescatarian": "pescatarian",
+    "pescetarian": "pescatarian",
+    "gluten_free": "gluten_free",
+    "celiac": "gluten_free",
+    "dairy_free": "dairy_free",
+    "lactose_free": "dairy_free",
+}
+
+ALLERGEN_ALIASES = {
+    "peanut": "peanuts", "peanuts": "peanuts", "peanut_free": "peanuts",
+    "nut": "nuts", "nuts": "nuts", "tree_nuts": "nuts", "tree_nut": "nuts", "nut_free": "nuts",
+    "dairy": "dairy", "milk": "dairy", "lactose": "dairy",
+    "egg": "eggs", "eggs": "eggs",
+    "gluten": "gluten", "wheat": "gluten",
+    "soy": "soy", "soya": "soy",
+    "fish": "fish",
+    "shellfish": "shellfish", "shrimp": "shellfish",
+    "sesame": "sesame",
+}
+
+def profile_tag_keys(profile: Optional[dict]) -> List[str]:
+    profile = profile or {}
+    return [
+        tag.replace("-", "_").replace(" ", "_")
+        for tag in normalize_tags(profile.get("dietary_restrictions")) + normalize_tags(profile.get("allergies"))
+    ]
+
+def profile_diet_tags(profile: Optional[dict]) -> tuple:
+    """Known diets and allergens from the profile's restrictions and allergies"""
+    diets, allergens = set(), set()
+    for tag in profile_tag_keys(profile):
+        if tag in DIET_ALIASES:
+            diets.add(DIET_ALIASES[tag])
+        elif tag in ALLERGEN_ALIASES:
+            allergens.add(ALLERGEN_ALIASES[tag])
+    return frozenset(diets), frozenset(allergens)
+
+def unsupported_diet_tags(profile: Optional[dict]) -> List[str]:
+    """Restrictions and allergies with no known diet or allergen tag (e.g. halal, keto)"""
+    return [tag for tag in profile_tag_keys(profile) if tag not in DIET_ALIASES and tag not in ALLERGEN_ALIASES]
+
+def build_fallback_plan(diets: frozenset, allergens: frozenset) -> dict:
+    """Compose a varied 7-day plan from the fallback meals compatible with the tags"""
+    options = {}
+    for meal_type in MEAL_TYPES:
+        compatible = [meal for meal in FALLBACK_MEALS[meal_type] if diets <= meal[4] and not allergens & meal[5]]
+        # Every slot has an allergen-free vegan option, so this only triggers for unusual tag mixes
+        options[meal_type] = compatible or [meal for meal in FALLBACK_MEALS[meal_type] if not meal[5] and "vegan" in meal[4]]
+    
+    days = []
+    for index in range(7):
+        day = {"day": index + 1, "fallback": True}
+        for offset, meal_type in enumerate(MEAL_TYPES):
+            name, ingredients, instructions, nutrition, _, _ = options[meal_type][(index + offset) % len(options[meal_type])]
+            day[meal_type] = {
+                "name": name,
+                "recipe": {"ingredients": list(ingredients), "instructions": list(instructions)},
+                "nutrition": dict(zip(NUTRITION_FIELDS, nutrition))
+            }
+        days.append(day)
+    return {"days": days}
+
+# Precomputed for the common diets; other tag combinations are added on first use
+fallback_plan_pool = {
+    (frozenset(diets), frozenset()): build_fallback_plan(frozenset(diets), frozenset())
+    for diets in [(), ("vegetarian",), ("vegan",), ("pescatarian",), ("gluten_free",), ("dairy_free",)]
+}
+
+def select_fallback_plan(profile: Optional[dict]) -> dict:
+    """A fallback plan matching the profile's restrictions, scaled to its calorie target"""
+    unsupported = unsupported_diet_tags(profile)
+    if unsupported:
+        logger.warning("Fallback plan ignores restrictions it cannot represent", extra={"tags": unsupported})
+    key = profile_diet_tags(profile)
+    if key not in fallback_plan_pool:
+        fallback_plan_pool[key] = build_fallback_plan(*key)
+    
+    plan = copy.deepcopy(fallback_plan_pool[key])
+    calories, _ = profile_targets(profile or {})
+    average = sum(day[meal_type]["nutrition"]["calories"] for day in plan["days"] for meal_type in MEAL_TYPES) / 7
+    return rescale_meal_plan(plan, calories / average)
+
+def build_fallback_day(day: int, profile: Optional[dict] = None) -> dict:
+    """Fallback meals used when the AI response for a day cannot be used"""
+    return select_fallback_plan(profile)["days"][day - 1]
+
+def build_week_prompt(profile: dict, compact: bool = False) -> str:
+    """Build the prompt asking for the whole 7-day meal plan in one call"""
+    header = f"""Create a 7-day meal plan JSON for:
+{build_profile_summary(profile)}
+"""
+    if compact:
+        return f"{header}\n{build_compact_format(1)}\nCreate all 7 days following this structure."
+    
+    # Build a simplified prompt for more reliable JSON generation
+    return f"""{header}
 Return ONLY valid JSON in this exact format (no extra text):
 {{
   "days": [
@@ -182,120 +1145,1034 @@ Return ONLY valid JSON in this exact format (no extra text):
 
 Create all 7 days following this structure. Ensure valid JSON syntax."""
 
+async def generate_meal_plan_with_ai(profile: dict) -> dict:
+    """Generate a 7-day meal plan using Claude Sonnet-4"""
+    
+    prompt = build_week_prompt(profile, LLM_COMPACT_SCHEMA)
+    
     try:
-        # Initialize LLM chat with Claude Sonnet-4
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"meal-plan-{uuid.uuid4()}",
-            system_message="You are a nutritionist. Return only valid JSON meal plans with no additional text or formatting."
-        ).with_model("anthropic", "claude-sonnet-4-20250514")
-        
         # Send message to AI
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
+        response = await send_llm_prompt(prompt, "week")
         
-        # Clean the response
-        response_text = response.strip()
+        # Parse the response, keeping every day that decoded cleanly
+        parser = MealPlanStreamParser(compact=LLM_COMPACT_SCHEMA)
+        parser.feed(response)
         
-        # Remove any markdown formatting
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        elif response_text.startswith("```"):
-            response_text = response_text[3:]
+        # A response cut off mid-week still carries the days before the cut
+        truncated = parser.started and not parser.complete
+        repaired_day = parser.repair() if truncated else None
         
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
+        logger.debug("LLM response received", extra={
+            "response_length": len(response),
+            "parsed_days": len(parser.days),
+            "complete": parser.complete,
+            "head": response[:100],
+            "tail": response[-100:]
+        })
         
-        response_text = response_text.strip()
+        if not parser.started:
+            raise ValueError("Missing 'days' in response")
         
-        # Find JSON object boundaries
-        start_idx = response_text.find('{')
-        end_idx = response_text.rfind('}')
+        for failed in parser.failed_days:
+            logger.warning("LLM day failed to parse", extra={"day": failed["index"], "error": failed["error"]})
         
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            response_text = response_text[start_idx:end_idx+1]
+        days_by_number = {}
+        for position, day in enumerate(parser.days, start=1):
+            day_number = day.get("day") if isinstance(day.get("day"), int) else position
+            days_by_number.setdefault(day_number, day)
         
-        print(f"AI Response length: {len(response_text)}")
-        print(f"AI Response starts with: {response_text[:100]}")
-        print(f"AI Response ends with: {response_text[-100:]}")
+        if truncated:
+            record_parse_outcome("week", "repaired")
+            if repaired_day is not None:
+                LLM_TRUNCATED_DAYS.labels(llm_backend.model_name, prompt_variant("week"), "repaired").inc()
+            missing = [day_number for day_number in range(1, 8) if day_number not in days_by_number]
+            logger.warning("Truncated meal plan response, regenerating missing days", extra={
+                "response_length": len(response),
+                "kept_days": len(days_by_number),
+                "missing_days": missing
+            })
+            days_by_number.update(await regenerate_missing_days(profile, days_by_number, missing))
+        elif len(days_by_number) != 7 or parser.failed_days:
+            logger.warning("Incomplete meal plan, using fallback for missing days", extra={"parsed_days": len(parser.days)})
+            record_parse_outcome("week", "fallback")
+        else:
+            record_parse_outcome("week", "ok")
         
-        try:
-            meal_plan_data = json.loads(response_text)
-            
-            # Validate structure
-            if "days" not in meal_plan_data:
-                raise ValueError("Missing 'days' in response")
-            
-            if len(meal_plan_data["days"]) != 7:
-                raise ValueError(f"Expected 7 days, got {len(meal_plan_data['days'])}")
-            
+        # Fill failed or missing days with the fallback plan
+        return await validate_and_repair_meal_plan(profile, {
+            "days": [
+                days_by_number.get(day_number) or build_fallback_day(day_number, profile)
+                for day_number in range(1, 8)
+            ]
+        })
+        
+    except CircuitOpenError:
+        record_parse_outcome("week", "fallback")
+        return select_fallback_plan(profile)
+    except Exception as e:
+        record_parse_outcome("week", "error")
+        logger.exception("Error generating meal plan")
+        raise HTTPException(status_code=500, detail=f"Failed to generate meal plan: {str(e)}")
+
+async def generate_day_with_ai(profile: dict, day_number: int, previous_meals: Optional[List[str]] = None, theme: Optional[str] = None,
+                              fallback_when_open: bool = True) -> Optional[dict]:
+    """Generate a single day of the meal plan, or None if the response is unusable.
+    
+    While the LLM circuit breaker is open the profile's fallback day is returned
+    instead, or CircuitOpenError is raised when fallback_when_open is False.
+    """
+    try:
+        response = await send_llm_prompt(build_day_prompt(profile, day_number, previous_meals, theme, LLM_COMPACT_SCHEMA), "day")
+    except CircuitOpenError:
+        if not fallback_when_open:
+            raise
+        record_parse_outcome("day", "fallback")
+        return build_fallback_day(day_number, profile)
+    
+    parser = MealPlanStreamParser(compact=LLM_COMPACT_SCHEMA)
+    parser.feed(response)
+    repaired = not parser.days and parser.repair() is not None
+    
+    if not parser.days:
+        for failed in parser.failed_days:
+            logger.warning("LLM day failed to parse", extra={"day": day_number, "error": failed["error"]})
+        record_parse_outcome("day", "error")
+        return None
+    
+    record_parse_outcome("day", "repaired" if repaired else "ok")
+    day = parser.days[0]
+    day["day"] = day_number
+    meal_plan_data = await validate_and_repair_meal_plan(profile, {"days": [day]}, previous_meals)
+    return meal_plan_data["days"][0]
+
+async def regenerate_missing_days(profile: dict, days_by_number: Dict[int, dict], missing: List[int]) -> Dict[int, dict]:
+    """Generate the days a truncated week response never reached.
+    
+    The missing days are generated concurrently, avoiding the meals of the days
+    that were kept. Days that still fail are left out for the fallback plan.
+    """
+    kept_meals = [
+        day[meal_type]["name"]
+        for day in days_by_number.values()
+        for meal_type in MEAL_TYPES
+        if isinstance(day.get(meal_type), dict) and day[meal_type].get("name")
+    ]
+    results = await asyncio.gather(
+        *(generate_day_with_ai(profile, day_number, kept_meals, DAY_THEMES[day_number - 1]) for day_number in missing),
+        return_exceptions=True
+    )
+    
+    regenerated = {}
+    for day_number, result in zip(missing, results):
+        if isinstance(result, Exception) or result is None:
+            recovery = "fallback"
+        else:
+            regenerated[day_number] = result
+            recovery = "fallback" if result.get("fallback") else "regenerated"
+        LLM_TRUNCATED_DAYS.labels(llm_backend.model_name, prompt_variant("week"), recovery).inc()
+    return regenerated
+
+def build_meal_prompt(profile: dict, day: int, meal_type: str, week_meals: List[str], current_meal: Optional[dict] = None, compact: bool = False) -> str:
+    """Build a prompt asking for a replacement for one meal of the plan"""
+    nutrition = (current_meal or {}).get("nutrition", {})
+    guide = ""
+    if nutrition.get("calories"):
+        guide = f"\nAim for about {nutrition['calories']} kcal and {nutrition.get('protein', 0)}g protein, like the meal it replaces.\n"
+    current_name = (current_meal or {}).get("name")
+    header = f"""Create a new {meal_type} for day {day} of a 7-day meal plan JSON for:
+{build_profile_summary(profile)}
+{guide}
+The user did not like: {current_name or 'the current meal'}
+Other meals this week (do not repeat): {', '.join(week_meals) or 'None'}
+"""
+    if compact:
+        short_key = next(key for key, value in COMPACT_MEAL_KEYS.items() if value == meal_type)
+        return f"""{header}
+Return ONLY minified JSON in this compact positional format (no extra text, no whitespace):
+{{"days":[{{"day":{day},"{short_key}":["Meal Name",["ingredient"],["step"],[350,12,60,8,6,15]]}}]}}
+
+The meal is [name, ingredients, instructions, [calories, protein, carbs, fat, fiber, sugar]].
+"""
+    return f"""{header}
+Return ONLY valid JSON for this one meal in this exact format (no extra text):
+{{
+  "days": [
+    {{
+      "day": {day},
+      "{meal_type}": {{
+        "name": "Meal Name",
+        "recipe": {{
+          "ingredients": ["ingredient"],
+          "instructions": ["step"]
+        }},
+        "nutrition": {{"calories": 350, "protein": 12, "carbs": 60, "fat": 8, "fiber": 6, "sugar": 15}}
+      }}
+    }}
+  ]
+}}
+
+Ensure valid JSON syntax."""
+
+async def generate_meal_with_ai(profile: dict, day_number: int, meal_type: str, week_meals: List[str], current_meal: Optional[dict] = None,
+                                fallback_when_open: bool = True) -> Optional[dict]:
+    """Generate a replacement for a single meal, or None if the response is unusable.
+    
+    While the LLM circuit breaker is open the fallback meal is returned instead, or
+    CircuitOpenError is raised when fallback_when_open is False.
+    """
+    try:
+        response = await send_llm_prompt(build_meal_prompt(profile, day_number, meal_type, week_meals, current_meal, LLM_COMPACT_SCHEMA), "meal", [meal_type])
+    except CircuitOpenError:
+        if not fallback_when_open:
+            raise
+        record_parse_outcome("meal", "fallback")
+        return build_fallback_day(day_number, profile)[meal_type]
+    
+    parser = MealPlanStreamParser(compact=LLM_COMPACT_SCHEMA, meal_types=[meal_type])
+    parser.feed(response)
+    
+    if not parser.days:
+        for failed in parser.failed_days:
+            logger.warning("LLM meal failed to parse", extra={"day": day_number, "meal_type": meal_type, "error": failed["error"]})
+        record_parse_outcome("meal", "error")
+        return None
+    
+    meal, errors = validate_meal(parser.days[0][meal_type])
+    if meal is None:
+        logger.warning("LLM meal failed validation", extra={"day": day_number, "meal_type": meal_type, "errors": errors})
+        record_parse_outcome("meal", "invalid")
+        return None
+    
+    record_parse_outcome("meal", "ok")
+    return meal
+
+async def generate_meal_plan_days_with_ai(profile: dict):
+    """Yield the 7 days of a meal plan one at a time, each from its own AI call.
+    
+    Each prompt lists the meals already generated so the week stays varied. A day
+    that cannot be parsed or whose call fails (e.g. times out) is retried up to
+    LLM_DAY_RETRIES times and then replaced by the static fallback day, so one bad
+    call never ends the stream.
+    """
+    previous_meals = []
+    for day_number in range(1, 8):
+        day = None
+        for attempt in range(LLM_DAY_RETRIES + 1):
+            if attempt:
+                LLM_RETRIES.labels(llm_backend.model_name, prompt_variant("day")).inc()
+            try:
+                day = await generate_day_with_ai(profile, day_number, previous_meals)
+            except Exception as e:
+                logger.warning("Day generation failed", extra={"day": day_number, "attempt": attempt + 1, "error": str(e)})
+            if day is not None:
+                break
+        if day is None:
+            logger.warning("Using fallback day after retries", extra={"day": day_number, "retries": LLM_DAY_RETRIES})
+            day = build_fallback_day(day_number, profile)
+        
+        previous_meals.extend(day[meal_type].get("name", "") for meal_type in MEAL_TYPES)
+        yield day
+
+async def generate_meal_plan_parallel(profile: dict) -> dict:
+    """Generate all 7 days concurrently, retrying only the days that failed.
+    
+    Concurrency is bounded by the LLM concurrency limiter, so wall-clock time is roughly
+    that of a single-day call when the limit allows all days at once.
+    """
+    days = {}
+    pending = list(range(1, 8))
+    last_error = None
+    
+    for attempt in range(LLM_DAY_RETRIES + 1):
+        if attempt:
+            LLM_RETRIES.labels(llm_backend.model_name, prompt_variant("day")).inc(len(pending))
+        results = await asyncio.gather(
+            *(generate_day_with_ai(profile, day_number, theme=DAY_THEMES[day_number - 1]) for day_number in pending),
+            return_exceptions=True
+        )
+        
+        failed = []
+        for day_number, result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.warning("Day generation failed", extra={"day": day_number, "attempt": attempt + 1, "error": str(result)})
+                last_error = result
+                failed.append(day_number)
+            elif result is None:
+                failed.append(day_number)
+            else:
+                days[day_number] = result
+        
+        pending = failed
+        if not pending:
+            break
+    
+    if not days and last_error is not None:
+        raise HTTPException(status_code=500, detail=f"Failed to generate meal plan: {str(last_error)}")
+    
+    if pending:
+        logger.warning("Using fallback days after retries", extra={"days": pending, "retries": LLM_DAY_RETRIES})
+    
+    return {"days": [days.get(day_number) or build_fallback_day(day_number, profile) for day_number in range(1, 8)]}
+
+async def generate_meal_plan_data(profile: dict) -> dict:
+    """Generate a meal plan using the configured generation mode.
+    
+    With MEAL_LIBRARY_FIRST the plan is composed from the meal library when it can
+    meet the profile's targets, and the LLM is only called when it cannot.
+    """
+    if MEAL_LIBRARY_FIRST:
+        meal_plan_data = solve_meal_plan_from_library(profile)
+        if meal_plan_data is not None:
+            cache_metrics["library_hits"] += 1
             return meal_plan_data
-            
-        except json.JSONDecodeError as json_error:
-            print(f"JSON parsing error at position {json_error.pos}: {json_error.msg}")
-            print(f"Context around error: {response_text[max(0, json_error.pos-50):json_error.pos+50]}")
-            
-            # Return a fallback meal plan for testing
-            return {
-                "days": [
-                    {
-                        "day": i + 1,
-                        "breakfast": {
-                            "name": f"Day {i+1} Breakfast",
-                            "recipe": {
-                                "ingredients": ["1 cup oats", "1 cup milk", "1 banana"],
-                                "instructions": ["Cook oats with milk", "Top with sliced banana"]
-                            },
-                            "nutrition": {
-                                "calories": 350,
-                                "protein": 12,
-                                "carbs": 60,
-                                "fat": 8,
-                                "fiber": 6,
-                                "sugar": 15
-                            }
-                        },
-                        "lunch": {
-                            "name": f"Day {i+1} Lunch",
-                            "recipe": {
-                                "ingredients": ["150g chicken", "2 cups salad", "1 tbsp dressing"],
-                                "instructions": ["Grill chicken", "Prepare salad", "Add dressing"]
-                            },
-                            "nutrition": {
-                                "calories": 400,
-                                "protein": 35,
-                                "carbs": 10,
-                                "fat": 20,
-                                "fiber": 4,
-                                "sugar": 5
-                            }
-                        },
-                        "dinner": {
-                            "name": f"Day {i+1} Dinner",
-                            "recipe": {
-                                "ingredients": ["1 cup rice", "100g vegetables", "1 tbsp oil"],
-                                "instructions": ["Cook rice", "Stir fry vegetables", "Combine"]
-                            },
-                            "nutrition": {
-                                "calories": 450,
-                                "protein": 15,
-                                "carbs": 70,
-                                "fat": 12,
-                                "fiber": 5,
-                                "sugar": 8
-                            }
-                        }
-                    }
-                    for i in range(7)
-                ]
+        cache_metrics["library_misses"] += 1
+    
+    if MEAL_PLAN_GENERATION_MODE == "parallel":
+        meal_plan_data = await generate_meal_plan_parallel(profile)
+    else:
+        meal_plan_data = await generate_meal_plan_with_ai(profile)
+    
+    await harvest_meals(profile, meal_plan_data)
+    return meal_plan_data
+
+# ============ Meal Plan Persistence ============
+
+def add_dining_out_flags(meal_plan_data: dict) -> dict:
+    """Add the dining_out flag to all meals"""
+    for day in meal_plan_data.get("days", []):
+        for meal_type in MEAL_TYPES:
+            if meal_type in day:
+                day[meal_type]["dining_out"] = False
+    return meal_plan_data
+
+async def save_meal_plan(user_id: str, meal_plan_data: dict) -> str:
+    """Save a generated meal plan and return its meal_plan_id"""
+    meal_plan_id = str(uuid.uuid4())
+    meal_plan_doc = {
+        "meal_plan_id": meal_plan_id,
+        "user_id": user_id,
+        "meal_plan": meal_plan_data,
+        "created_at": datetime.utcnow().isoformat()
+    }
+    
+    await db.meal_plans.insert_one(meal_plan_doc)
+    return meal_plan_id
+
+# ============ Meal Plan Cache ============
+
+# Profile fields that change the generated plan; anything else (e.g. height) is ignored
+PROFILE_FINGERPRINT_FIELDS = [
+    "gender",
+    "age",
+    "weight",
+    "activity_level",
+    "fitness_goal",
+    "calorie_target",
+    "protein_target",
+    "fiber_target",
+    "dietary_restrictions",
+    "allergies",
+]
+
+cache_metrics = {"hits": 0, "band_hits": 0, "misses": 0, "refreshes": 0, "library_hits": 0, "library_misses": 0}
+
+def profile_fingerprint(profile: dict) -> str:
+    """Canonical hash of the prompt-relevant profile fields"""
+    canonical = {}
+    for field in PROFILE_FINGERPRINT_FIELDS:
+        value = profile.get(field)
+        if isinstance(value, list):
+            value = normalize_tags(value)
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        canonical[field] = value
+    payload = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def normalize_tags(values: Optional[List[str]]) -> List[str]:
+    return sorted({str(value).strip().lower() for value in values or [] if str(value).strip()})
+
+def profile_targets(profile: dict) -> tuple:
+    """Daily calorie and protein targets, using the prompt defaults when unset"""
+    return profile.get("calorie_target") or 2000, profile.get("protein_target") or 100
+
+def profile_band_key(profile: dict) -> str:
+    """Bucket key for approximate reuse: nutrition bands, goal and restriction set"""
+    calories, protein = profile_targets(profile)
+    band = {
+        "calorie_band": int(calories // PLAN_REUSE_CALORIE_BAND),
+        "protein_band": int(protein // PLAN_REUSE_PROTEIN_BAND),
+        "fitness_goal": str(profile.get("fitness_goal") or "").strip().lower(),
+        "dietary_restrictions": normalize_tags(profile.get("dietary_restrictions")),
+        "allergies": normalize_tags(profile.get("allergies")),
+    }
+    payload = json.dumps(band, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def rescale_meal_plan(meal_plan_data: dict, factor: float) -> dict:
+    """Scale every meal's nutrition values by factor (in place)"""
+    if abs(factor - 1.0) < 0.005:
+        return meal_plan_data
+    for day in meal_plan_data.get("days", []):
+        for meal_type in MEAL_TYPES:
+            nutrition = day.get(meal_type, {}).get("nutrition", {})
+            for field in NUTRITION_FIELDS:
+                if isinstance(nutrition.get(field), (int, float)):
+                    nutrition[field] = round(nutrition[field] * factor)
+    return meal_plan_data
+
+def plan_has_fallback(meal_plan_data: dict) -> bool:
+    return any(day.get("fallback") for day in meal_plan_data.get("days", []))
+
+async def get_cached_meal_plan(profile: dict) -> Optional[dict]:
+    """Exact fingerprint lookup, then a band lookup rescaled to this profile's calories"""
+    cached = await db.meal_plan_cache.find_one({"_id": profile_fingerprint(profile)}, {"_id": 0, "meal_plan": 1})
+    if cached:
+        cache_metrics["hits"] += 1
+        return cached["meal_plan"]
+    
+    if PLAN_REUSE_ENABLED:
+        cached = await db.meal_plan_cache.find_one(
+            {"band_key": profile_band_key(profile)},
+            {"_id": 0, "meal_plan": 1, "calorie_target": 1}
+        )
+        if cached:
+            cache_metrics["band_hits"] += 1
+            calories, _ = profile_targets(profile)
+            return rescale_meal_plan(cached["meal_plan"], calories / (cached.get("calorie_target") or calories))
+    
+    cache_metrics["misses"] += 1
+    return None
+
+async def store_cached_meal_plan(profile: dict, meal_plan_data: dict):
+    """Cache a generated plan; plans containing fallback days are never cached"""
+    if plan_has_fallback(meal_plan_data):
+        return
+    fingerprint = profile_fingerprint(profile)
+    calories, protein = profile_targets(profile)
+    await db.meal_plan_cache.replace_one(
+        {"_id": fingerprint},
+        {
+            "_id": fingerprint,
+            "band_key": profile_band_key(profile),
+            "calorie_target": calories,
+            "protein_target": protein,
+            "meal_plan": meal_plan_data,
+            "created_at": datetime.utcnow()
+        },
+        upsert=True
+    )
+
+async def lookup_meal_plan_cache(profile: dict, force_refresh: bool = False) -> Optional[dict]:
+    if force_refresh:
+        cache_metrics["refreshes"] += 1
+        return None
+    return await get_cached_meal_plan(profile)
+
+async def get_or_generate_meal_plan(profile: dict, force_refresh: bool = False) -> dict:
+    """Serve a cached plan for this profile or generate and cache a new one"""
+    cached = await lookup_meal_plan_cache(profile, force_refresh)
+    if cached is not None:
+        return cached
+    
+    meal_plan_data = await generate_meal_plan_data(profile)
+    await store_cached_meal_plan(profile, meal_plan_data)
+    return meal_plan_data
+
+# ============ Meal Library ============
+
+# Ingredient keywords used to tag harvested meals with allergens (deliberately conservative)
+ALLERGEN_KEYWORDS = {
+    "peanuts": ["peanut"],
+    "nuts": ["almond", "walnut", "cashew", "pecan", "pistachio", "hazelnut", "macadamia", "granola"],
+    "dairy": ["milk", "cheese", "yogurt", "yoghurt", "butter", "cream", "feta", "mozzarella", "parmesan", "ricotta", "whey"],
+    "eggs": ["egg", "mayonnaise", "mayo"],
+    "gluten": ["bread", "pasta", "flour", "wheat", "tortilla", "couscous", "barley", "noodle", "oat", "granola", "soy sauce", "toast", "pita", "bagel"],
+    "soy": ["soy", "tofu", "tempeh", "edamame"],
+    "fish": ["salmon", "tuna", "cod", "fish", "sardine", "mackerel", "tilapia", "anchov"],
+    "shellfish": ["shrimp", "prawn", "crab", "lobster", "scallop", "mussel", "clam"],
+    "sesame": ["sesame", "tahini"],
+}
+
+def infer_allergens(ingredients: List[str]) -> set:
+    text = " ".join(ingredients).lower()
+    return {allergen for allergen, keywords in ALLERGEN_KEYWORDS.items() if any(keyword in text for keyword in keywords)}
+
+def meal_library_id(meal_type: str, name: str) -> str:
+    return hashlib.sha1(f"{meal_type}:{name.strip().lower()}".encode("utf-8")).hexdigest()
+
+DIET_BITS = {diet: 1 << index for index, diet in enumerate(sorted(set(DIET_ALIASES.values())))}
+ALLERGEN_BITS = {allergen: 1 << index for index, allergen in enumerate(sorted(set(ALLERGEN_ALIASES.values())))}
+
+def tag_mask(tags, bits: Dict[str, int]) -> int:
+    mask = 0
+    for tag in tags:
+        mask |= bits.get(tag, 0)
+    return mask
+
+class MealLibrary:
+    """In-memory index of meals collected from past generations, grouped by meal type.
+    
+    Per meal type, nutrition is kept as a contiguous float32 matrix (one row per meal,
+    columns in NUTRITION_FIELDS order) with diet and allergen bitmasks alongside, so
+    filtering and scoring are vectorized over the whole library.
+    """
+    
+    def __init__(self, capacity: int = 1024):
+        self.slots = {
+            meal_type: {
+                "entries": [],
+                "rows": {},
+                "nutrition": np.zeros((capacity, len(NUTRITION_FIELDS)), dtype=np.float32),
+                "diets": np.zeros(capacity, dtype=np.uint32),
+                "allergens": np.zeros(capacity, dtype=np.uint32),
             }
+            for meal_type in MEAL_TYPES
+        }
+    
+    def size(self) -> int:
+        return sum(len(slot["entries"]) for slot in self.slots.values())
+    
+    def add(self, entry: dict):
+        slot = self.slots[entry["meal_type"]]
+        row = slot["rows"].get(entry["meal_id"])
+        if row is not None:
+            existing = slot["entries"][row]
+            existing["diets"] |= entry["diets"]
+            slot["diets"][row] = tag_mask(existing["diets"], DIET_BITS)
+            return
+        if self.size() >= MEAL_LIBRARY_MAX_SIZE:
+            return
+        
+        row = len(slot["entries"])
+        if row == len(slot["diets"]):
+            for key in ("nutrition", "diets", "allergens"):
+                grown = np.zeros((row * 2,) + slot[key].shape[1:], dtype=slot[key].dtype)
+                grown[:row] = slot[key]
+                slot[key] = grown
         
+        slot["entries"].append(entry)
+        slot["rows"][entry["meal_id"]] = row
+        slot["nutrition"][row] = [entry["nutrition"][field] for field in NUTRITION_FIELDS]
+        slot["diets"][row] = tag_mask(entry["diets"], DIET_BITS)
+        slot["allergens"][row] = tag_mask(entry["allergens"], ALLERGEN_BITS)
+    
+    def entry(self, meal_type: str, row: int) -> dict:
+        return self.slots[meal_type]["entries"][row]
+    
+    def candidate_rows(self, meal_type: str, diets: frozenset, allergens: frozenset) -> np.ndarray:
+        """Rows of meals that satisfy every diet and contain none of the allergens"""
+        slot = self.slots[meal_type]
+        count = len(slot["entries"])
+        diet_mask = tag_mask(diets, DIET_BITS)
+        allergen_mask = tag_mask(allergens, ALLERGEN_BITS)
+        compatible = ((slot["diets"][:count] & diet_mask) == diet_mask) & ((slot["allergens"][:count] & allergen_mask) == 0)
+        return np.flatnonzero(compatible)
+    
+    def top_day_combinations(self, targets: Dict[str, tuple], pools: Dict[str, np.ndarray], k: int = 1, shortlist: int = 32) -> List[tuple]:
+        """The k breakfast/lunch/dinner combinations closest to the daily targets.
+        
+        Each slot is first narrowed to the `shortlist` meals nearest its usual share
+        of the targets; all shortlist combinations are then scored at once by
+        broadcasting. Returns (error, feasible, {meal_type: row}) tuples, best first.
+        """
+        fields = list(targets)
+        columns = [NUTRITION_FIELDS.index(field) for field in fields]
+        target = np.array([targets[field][0] for field in fields], dtype=np.float32)
+        tolerance = np.array([targets[field][1] for field in fields], dtype=np.float32)
+        
+        values = {meal_type: self.slots[meal_type]["nutrition"][pools[meal_type]][:, columns] for meal_type in MEAL_TYPES}
+        means = np.array([values[meal_type].mean(axis=0) for meal_type in MEAL_TYPES])
+        shares = means / np.maximum(means.sum(axis=0), 1e-6)
+        
+        rows, shortlisted = [], []
+        for index, meal_type in enumerate(MEAL_TYPES):
+            slot_rows, slot_values = pools[meal_type], values[meal_type]
+            if len(slot_rows) > shortlist:
+                distance = (((slot_values - target * shares[index]) / target) ** 2).sum(axis=1)
+                keep = np.argpartition(distance, shortlist)[:shortlist]
+                slot_rows, slot_values = slot_rows[keep], slot_values[keep]
+            rows.append(slot_rows)
+            shortlisted.append(slot_values)
+        
+        breakfast, lunch, dinner = shortlisted
+        totals = breakfast[:, None, None, :] + lunch[None, :, None, :] + dinner[None, None, :, :]
+        deviation = ((totals - target) / target).reshape(-1, len(fields))
+        error = (deviation ** 2).sum(axis=1)
+        
+        k = min(k, error.size)
+        best = np.argpartition(error, k - 1)[:k]
+        best = best[np.argsort(error[best])]
+        feasible = (np.abs(deviation[best]) <= tolerance).all(axis=1)
+        indices = np.unravel_index(best, tuple(len(slot_rows) for slot_rows in rows))
+        
+        return [
+            (
+                float(error[best[rank]]),
+                bool(feasible[rank]),
+                {meal_type: int(rows[slot][indices[slot][rank]]) for slot, meal_type in enumerate(MEAL_TYPES)}
+            )
+            for rank in range(k)
+        ]
+
+meal_library = MealLibrary()
+
+def library_entry(meal_type: str, meal: dict, diets: set) -> Optional[dict]:
+    """Library record for a generated meal, or None if its nutrition is unusable"""
+    nutrition = meal.get("nutrition", {})
+    if not meal.get("name") or not all(isinstance(nutrition.get(field), (int, float)) for field in NUTRITION_FIELDS):
+        return None
+    recipe = meal.get("recipe", {})
+    return {
+        "meal_id": meal_library_id(meal_type, meal["name"]),
+        "meal_type": meal_type,
+        "name": meal["name"],
+        "recipe": {"ingredients": recipe.get("ingredients", []), "instructions": recipe.get("instructions", [])},
+        "nutrition": {field: nutrition[field] for field in NUTRITION_FIELDS},
+        "diets": set(diets),
+        "allergens": infer_allergens(recipe.get("ingredients", []))
+    }
+
+async def harvest_meals(profile: dict, meal_plan_data: dict):
+    """Add the meals of an AI-generated plan to the library.
+    
+    Meals are tagged with the diets the generating profile asked for (the prompt
+    enforced them) and with allergens inferred from their ingredients.
+    """
+    diets, _ = profile_diet_tags(profile)
+    operations = []
+    for day in meal_plan_data.get("days", []):
+        if day.get("fallback"):
+            continue
+        for meal_type in MEAL_TYPES:
+            entry = library_entry(meal_type, day.get(meal_type, {}), diets)
+            if entry is None:
+                continue
+            meal_library.add(entry)
+            fields = {key: value for key, value in entry.items() if key not in ("diets", "allergens")}
+            operations.append(UpdateOne(
+                {"_id": entry["meal_id"]},
+                {
+                    "$set": {**fields, "allergens": sorted(entry["allergens"]), "updated_at": datetime.utcnow()},
+                    "$addToSet": {"diets": {"$each": sorted(diets)}}
+                },
+                upsert=True
+            ))
+    
+    if operations:
+        try:
+            await db.meal_library.bulk_write(operations, ordered=False)
+        except Exception:
+            logger.exception("Error saving meals to library")
+
+async def load_meal_library():
+    cursor = db.meal_library.find({}, {"_id": 0, "updated_at": 0}).limit(MEAL_LIBRARY_MAX_SIZE)
+    async for doc in cursor:
+        doc["diets"] = set(doc.get("diets", []))
+        doc["allergens"] = set(doc.get("allergens", []))
+        meal_library.add(doc)
+    logger.info("Meal library loaded", extra={"meals": meal_library.size()})
+
+def library_day_targets(profile: dict) -> Dict[str, tuple]:
+    """Daily (target, tolerance) per nutrient the solver has to meet"""
+    calories, protein = profile_targets(profile)
+    targets = {
+        "calories": (calories, MEAL_LIBRARY_CALORIE_TOLERANCE),
+        "protein": (protein, MEAL_LIBRARY_PROTEIN_TOLERANCE),
+    }
+    if profile.get("fiber_target"):
+        targets["fiber"] = (profile["fiber_target"], MEAL_LIBRARY_FIBER_TOLERANCE)
+    return targets
+
+def library_day(rows: Dict[str, int], day_number: int) -> dict:
+    day = {"day": day_number}
+    for meal_type, row in rows.items():
+        meal = meal_library.entry(meal_type, row)
+        day[meal_type] = {
+            "name": meal["name"],
+            "recipe": copy.deepcopy(meal["recipe"]),
+            "nutrition": dict(meal["nutrition"])
+        }
+    return day
+
+def library_candidate_pools(profile: dict) -> Optional[Dict[str, np.ndarray]]:
+    """Compatible library rows per meal type, or None if the profile has a restriction
+    the library cannot check, in which case only the LLM can honour it"""
+    if unsupported_diet_tags(profile):
+        return None
+    diets, allergens = profile_diet_tags(profile)
+    return {meal_type: meal_library.candidate_rows(meal_type, diets, allergens) for meal_type in MEAL_TYPES}
+
+def top_library_days(profile: dict, k: int = 5) -> List[dict]:
+    """The k single-day meal combinations from the library closest to the profile's targets"""
+    pools = library_candidate_pools(profile)
+    if pools is None or any(len(pool) == 0 for pool in pools.values()):
+        return []
+    ranked = meal_library.top_day_combinations(library_day_targets(profile), pools, k)
+    return [
+        {"error": error, "within_tolerance": feasible, **library_day(rows, rank + 1)}
+        for rank, (error, feasible, rows) in enumerate(ranked)
+    ]
+
+def solve_meal_plan_from_library(profile: dict) -> Optional[dict]:
+    """Compose a 7-day plan from the library that meets the profile's daily targets.
+    
+    Each day takes the best-scoring combination of meals not yet used this week.
+    Returns None when the profile has restrictions the library cannot represent,
+    the library has too few compatible meals or a day cannot be brought within
+    tolerance.
+    """
+    pools = library_candidate_pools(profile)
+    if pools is None or any(len(pool) < 7 for pool in pools.values()):
+        return None
+    
+    targets = library_day_targets(profile)
+    days = []
+    for day_number in range(1, 8):
+        _, feasible, rows = meal_library.top_day_combinations(targets, pools)[0]
+        if not feasible:
+            return None
+        days.append(library_day(rows, day_number))
+        for meal_type, row in rows.items():
+            pools[meal_type] = pools[meal_type][pools[meal_type] != row]
+    
+    return {"days": days}
+
+# ============ Single-Flight Generation ============
+
+# In-process: concurrent requests for the same user and profile share one task
+inflight_generations: Dict[str, asyncio.Task] = {}
+
+async def generate_and_save_meal_plan(user_id: str, profile: dict, force_refresh: bool = False) -> dict:
+    meal_plan_data = await get_or_generate_meal_plan(profile, force_refresh)
+    
+    # Add dining_out flag to all meals and save meal plan to database
+    add_dining_out_flags(meal_plan_data)
+    meal_plan_id = await save_meal_plan(user_id, meal_plan_data)
+    return {"meal_plan_id": meal_plan_id, "meal_plan": meal_plan_data}
+
+async def acquire_generation_lease(key: str, owner: str, take_finished: bool = False) -> bool:
+    """Take the cross-worker lease for key, or take over an expired one.
+    
+    With take_finished a lease whose generation already finished (and is only kept
+    for its grace period) is taken over as well.
+    """
+    now = datetime.utcnow()
+    lease = {"owner": owner, "meal_plan_id": None, "expires_at": now + timedelta(seconds=GENERATION_LEASE_SECONDS)}
+    try:
+        await db.generation_leases.insert_one({"_id": key, **lease})
+        return True
+    except DuplicateKeyError:
+        takeover = {"_id": key, "expires_at": {"$lt": now}}
+        if take_finished:
+            takeover = {"_id": key, "$or": [{"expires_at": {"$lt": now}}, {"meal_plan_id": {"$ne": None}}]}
+        taken = await db.generation_leases.find_one_and_update(
+            takeover,
+            {"$set": lease},
+            projection={"_id": 1}
+        )
+        return taken is not None
+
+async def wait_for_generation_lease(key: str, reuse_result: bool = True) -> Optional[dict]:
+    """Wait for another worker's generation; None if its lease disappears without a result.
+    
+    Without reuse_result a finished generation is not handed out either, so the
+    caller takes the lease over and generates a plan of its own.
+    """
+    while True:
+        lease = await db.generation_leases.find_one({"_id": key}, {"_id": 0, "meal_plan_id": 1, "expires_at": 1})
+        if lease is None or lease["expires_at"] < datetime.utcnow():
+            return None
+        if lease.get("meal_plan_id"):
+            if not reuse_result:
+                return None
+            meal_plan = await db.meal_plans.find_one(
+                {"meal_plan_id": lease["meal_plan_id"]},
+                {"_id": 0, "meal_plan_id": 1, "meal_plan": 1}
+            )
+            if meal_plan:
+                return meal_plan
+            # The plan is gone; poll until the lease's grace period lapses instead of spinning
+        await asyncio.sleep(GENERATION_LEASE_POLL_SECONDS)
+
+async def renew_generation_lease(key: str, owner: str):
+    """Keep the lease alive while a generation runs, however long its LLM calls take"""
+    while True:
+        await asyncio.sleep(GENERATION_LEASE_SECONDS / 3)
+        try:
+            await db.generation_leases.update_one(
+                {"_id": key, "owner": owner},
+                {"$set": {"expires_at": datetime.utcnow() + timedelta(seconds=GENERATION_LEASE_SECONDS)}}
+            )
+        except Exception:
+            logger.exception("Could not renew generation lease", extra={"lease": key})
+
+async def run_leased_generation(key: str, user_id: str, profile: dict, force_refresh: bool) -> dict:
+    owner = str(uuid.uuid4())
+    # A forced refresh must not be answered with the plan of a generation that just finished
+    while not await acquire_generation_lease(key, owner, take_finished=force_refresh):
+        result = await wait_for_generation_lease(key, reuse_result=not force_refresh)
+        if result is not None:
+            return result
+    
+    heartbeat = asyncio.create_task(renew_generation_lease(key, owner))
+    try:
+        result = await generate_and_save_meal_plan(user_id, profile, force_refresh)
+    except BaseException:
+        await db.generation_leases.delete_one({"_id": key, "owner": owner})
+        raise
+    finally:
+        heartbeat.cancel()
+    
+    # Keep the result briefly so retries that arrive just after completion get the same plan
+    await db.generation_leases.update_one(
+        {"_id": key, "owner": owner},
+        {"$set": {
+            "meal_plan_id": result["meal_plan_id"],
+            "expires_at": datetime.utcnow() + timedelta(seconds=GENERATION_RESULT_GRACE_SECONDS)
+        }}
+    )
+    return result
+
+async def single_flight_generate(user_id: str, profile: dict, force_refresh: bool = False) -> dict:
+    """Generate and save a meal plan, coalescing concurrent requests for the same user and profile"""
+    key = f"{user_id}:{profile_fingerprint(profile)}"
+    # Forced refreshes only coalesce with each other, never with a possibly cached generation
+    local_key = f"{key}:refresh" if force_refresh else key
+    task = inflight_generations.get(local_key)
+    if task is None:
+        task = asyncio.create_task(run_leased_generation(key, user_id, profile, force_refresh))
+        inflight_generations[local_key] = task
+        task.add_done_callback(lambda _: inflight_generations.pop(local_key, None))
+    
+    # Shield so one caller disconnecting does not cancel the generation for the others
+    return await asyncio.shield(task)
+
+# ============ Generation Job Queue ============
+
+# Wakes local workers as soon as a job is enqueued instead of waiting for the next poll
+job_queue_event = asyncio.Event()
+
+async def enqueue_generation_job(user_id: str, profile: dict, force_refresh: bool = False) -> str:
+    job_id = str(uuid.uuid4())
+    now = datetime.utcnow()
+    await db.jobs.insert_one({
+        "job_id": job_id,
+        "user_id": user_id,
+        "profile": profile,
+        "force_refresh": force_refresh,
+        "status": "queued",
+        "attempts": 0,
+        "meal_plan_id": None,
+        "error": None,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "created_at": now,
+        "updated_at": now
+    })
+    job_queue_event.set()
+    return job_id
+
+def claimable_jobs_filter(now: datetime) -> dict:
+    """Queued jobs, and running jobs whose lease expired with attempts left"""
+    return {"$or": [
+        {"status": "queued"},
+        {"status": "running", "lease_expires_at": {"$lt": now}, "attempts": {"$lt": JOB_MAX_ATTEMPTS}}
+    ]}
+
+def exhausted_jobs_filter(now: datetime) -> dict:
+    """Running jobs whose lease expired on their last attempt"""
+    return {"status": "running", "lease_expires_at": {"$lt": now}, "attempts": {"$gte": JOB_MAX_ATTEMPTS}}
+
+async def claim_generation_job(worker_id: str) -> Optional[dict]:
+    """Atomically lease the oldest queued job, or a running job whose lease expired.
+    
+    An expired job is only taken over while it has attempts left, so a job that
+    keeps crashing its worker is not retried forever; expired jobs without attempts
+    left are marked failed here so their status does not stay running.
+    """
+    now = datetime.utcnow()
+    await db.jobs.update_many(
+        exhausted_jobs_filter(now),
+        {"$set": {
+            "status": "failed",
+            "error": "Generation worker stopped on the last attempt",
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "updated_at": now
+        }}
+    )
+    return await db.jobs.find_one_and_update(
+        claimable_jobs_filter(now),
+        {
+            "$set": {
+                "status": "running",
+                "lease_owner": worker_id,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        projection={"_id": 0, "job_id": 1, "user_id": 1, "profile": 1, "force_refresh": 1, "attempts": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def renew_job_lease(job_id: str, worker_id: str):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            await db.jobs.update_one(
+                {"job_id": job_id, "lease_owner": worker_id},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)}}
+            )
+        except Exception:
+            # The next beat retries; the lease only lapses if every renewal fails
+            logger.exception("Could not renew job lease", extra={"job_id": job_id, "worker_id": worker_id})
+
+async def process_generation_job(job: dict, worker_id: str):
+    heartbeat = asyncio.create_task(renew_job_lease(job["job_id"], worker_id))
+    try:
+        result = await single_flight_generate(job["user_id"], job["profile"], job.get("force_refresh", False))
+        update = {"status": "done", "meal_plan_id": result["meal_plan_id"], "error": None}
     except Exception as e:
-        print(f"Error generating meal plan: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to generate meal plan: {str(e)}")
+        logger.exception("Generation job failed", extra={"job_id": job["job_id"], "attempt": job["attempts"]})
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        status_value = "queued" if job["attempts"] < JOB_MAX_ATTEMPTS else "failed"
+        update = {"status": status_value, "error": error}
+    finally:
+        heartbeat.cancel()
+    
+    update.update({"lease_owner": None, "lease_expires_at": None, "updated_at": datetime.utcnow()})
+    await db.jobs.update_one({"job_id": job["job_id"], "lease_owner": worker_id}, {"$set": update})
+
+async def generation_worker(worker_id: str):
+    """Claim and process jobs until cancelled; errors are logged and never end the loop"""
+    while True:
+        try:
+            job = await claim_generation_job(worker_id)
+            if job is None:
+                job_queue_event.clear()
+                try:
+                    await asyncio.wait_for(job_queue_event.wait(), timeout=JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            await process_generation_job(job, worker_id)
+        except Exception:
+            logger.exception("Generation worker error", extra={"worker_id": worker_id})
+            # Back off so a database outage does not turn into a busy loop
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+def start_generation_workers() -> List[asyncio.Task]:
+    node_id = uuid.uuid4().hex[:8]
+    return [
+        asyncio.create_task(generation_worker(f"{node_id}-{index}"))
+        for index in range(GENERATION_WORKERS)
+    ]
+
+# ============ Database Indexes ============
+
+async def create_index(collection: str, keys, **options):
+    """Create one index, logging instead of raising when the server rejects it.
+    
+    e.g. duplicate usernames left by the old register race block the unique index;
+    the app keeps working without it until the data is cleaned up.
+    """
+    try:
+        await db[collection].create_index(keys, **options)
+    except OperationFailure as e:
+        logger.error("Could not create index", extra={"collection": collection, "keys": str(keys), "error": str(e)})
+
+async def ensure_indexes():
+    """Create the indexes the app relies on; safe to run on every startup"""
+    # Login/registration look users up by username, every authenticated request by user_id
+    await create_index("users", "username", unique=True)
+    await create_index("users", "user_id", unique=True)
+    # Latest plan per user and history pages, and plan lookups by id
+    await create_index("meal_plans", [("user_id", 1), ("created_at", -1), ("meal_plan_id", -1)])
+    await create_index("meal_plans", "meal_plan_id", unique=True)
+    # Cached plans expire MEAL_PLAN_CACHE_TTL_SECONDS after they were stored
+    await create_index("meal_plan_cache", "created_at", expireAfterSeconds=MEAL_PLAN_CACHE_TTL_SECONDS)
+    await create_index("meal_plan_cache", "band_key")
+    await create_index("generation_leases", "expires_at", expireAfterSeconds=0)
+    await create_index("jobs", "job_id", unique=True)
+    await create_index("jobs", [("status", 1), ("created_at", 1)])
+
+# Only the fields the grocery list reads
+GROCERY_PROJECTION = {
+    "_id": 0,
+    **{f"meal_plan.days.{meal_type}.recipe.ingredients": 1 for meal_type in MEAL_TYPES},
+    **{f"meal_plan.days.{meal_type}.dining_out": 1 for meal_type in MEAL_TYPES}
+}
+
+def build_grocery_list(meal_plan: dict) -> List[str]:
+    """Aggregate the ingredients of all meals that are not marked as dining_out"""
+    all_ingredients = []
+    
+    for day in meal_plan["days"]:
+        for meal_type in MEAL_TYPES:
+            if meal_type in day:
+                meal = day[meal_type]
+                # Only include meals that are not dining out
+                if not meal.get("dining_out", False):
+                    ingredients = meal.get("recipe", {}).get("ingredients", [])
+                    all_ingredients.extend(ingredients)
+    
+    return all_ingredients
+
+HISTORY_DEFAULT_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+
+def encode_history_cursor(created_at: str, meal_plan_id: str) -> str:
+    """Opaque cursor pointing just past the given plan in the history order"""
+    return base64.urlsafe_b64encode(orjson.dumps([created_at, meal_plan_id])).decode()
+
+def decode_history_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        created_at, meal_plan_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(created_at, str) or not isinstance(meal_plan_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, meal_plan_id
+
+def build_history_pipeline(user_id: str, position: Optional[Tuple[str, str]], limit: int) -> List[dict]:
+    """Aggregation for up to `limit` plan summaries after a (created_at, meal_plan_id) position, newest first"""
+    match = {"user_id": user_id}
+    if position:
+        created_at, meal_plan_id = position
+        match["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "meal_plan_id": {"$lt": meal_plan_id}}
+        ]
+    
+    # Calorie totals are summed in the database so recipes never leave it
+    day_calories = {"$sum": [f"$$day.{meal_type}.nutrition.calories" for meal_type in MEAL_TYPES]}
+    return [
+        {"$match": match},
+        {"$sort": {"created_at": -1, "meal_plan_id": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "meal_plan_id": 1,
+            "created_at": 1,
+            "daily_calories": {"$map": {"input": "$meal_plan.days", "as": "day", "in": day_calories}}
+        }}
+    ]
+
+def format_sse(event: str, data: dict) -> str:
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {orjson.dumps(data, default=orjson_default).decode()}\n\n"
 
 # ============ API Endpoints ============
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this process"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "NutriPlan API"}
@@ -304,7 +2181,7 @@ async def health_check():
 async def register(user_data: UserRegister):
     """Register a new user"""
     # Check if username already exists
-    existing_user = await db.users.find_one({"username": user_data.username})
+    existing_user = await db.users.find_one({"username": user_data.username}, {"_id": 1})
     if existing_user:
         raise HTTPException(status_code=400, detail="Username already exists")
     
@@ -320,7 +2197,11 @@ async def register(user_data: UserRegister):
         "created_at": datetime.utcnow().isoformat()
     }
     
-    await db.users.insert_one(new_user)
+    try:
+        await db.users.insert_one(new_user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration of the same username
+        raise HTTPException(status_code=400, detail="Username already exists")
     
     # Create access token
     access_token = create_access_token({"sub": user_id})
@@ -330,7 +2211,8 @@ async def register(user_data: UserRegister):
 @app.post("/api/auth/login", response_model=TokenResponse)
 async def login(user_data: UserLogin):
     """Login user"""
-    user = await db.users.find_one({"username": user_data.username})
+    # Login is the one read that needs the password hash
+    user = await db.users.find_one({"username": user_data.username}, {"_id": 0, "user_id": 1, "password": 1})
     if not user or not verify_password(user_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
@@ -361,8 +2243,11 @@ async def create_or_update_profile(profile: UserProfile, current_user: dict = De
     return {"message": "Profile updated successfully", "profile": profile_data}
 
 @app.post("/api/meal-plan/generate")
-async def generate_meal_plan(current_user: dict = Depends(get_current_user)):
-    """Generate a new 7-day meal plan using AI"""
+async def generate_meal_plan(force_refresh: bool = False, mode: str = "sync", current_user: dict = Depends(get_current_user)):
+    """Generate a new 7-day meal plan using AI, reusing a cached plan for identical profiles.
+    
+    With mode=job the request is queued and answered with 202 and a job_id to poll.
+    """
     
     # Check if user has a profile
     if not current_user.get("profile"):
@@ -370,106 +2255,316 @@ async def generate_meal_plan(current_user: dict = Depends(get_current_user)):
     
     profile = current_user["profile"]
     
-    # Generate meal plan using AI
-    meal_plan_data = await generate_meal_plan_with_ai(profile)
+    if mode == "job":
+        job_id = await enqueue_generation_job(current_user["user_id"], profile, force_refresh)
+        return AppJSONResponse(status_code=status.HTTP_202_ACCEPTED, content={
+            "job_id": job_id,
+            "status": "queued",
+            "message": "Meal plan generation queued"
+        })
+    if mode != "sync":
+        raise HTTPException(status_code=400, detail="mode must be 'sync' or 'job'")
     
-    # Add dining_out flag to all meals
-    for day in meal_plan_data.get("days", []):
-        for meal_type in ["breakfast", "lunch", "dinner"]:
-            if meal_type in day:
-                day[meal_type]["dining_out"] = False
+    # Generate meal plan using AI (or the profile cache); duplicate requests share one result
+    result = await single_flight_generate(current_user["user_id"], profile, force_refresh)
     
-    # Save meal plan to database
-    meal_plan_id = str(uuid.uuid4())
-    meal_plan_doc = {
-        "meal_plan_id": meal_plan_id,
-        "user_id": current_user["user_id"],
-        "meal_plan": meal_plan_data,
-        "created_at": datetime.utcnow().isoformat()
-    }
+    return AppJSONResponse({
+        "meal_plan_id": result["meal_plan_id"],
+        "meal_plan": result["meal_plan"],
+        "message": "Meal plan generated successfully"
+    })
+
+@app.get("/api/meal-plan/generate/stream")
+async def generate_meal_plan_stream(force_refresh: bool = False, current_user: dict = Depends(get_current_user)):
+    """Generate a new 7-day meal plan, streaming each day as a Server-Sent Event"""
     
-    await db.meal_plans.insert_one(meal_plan_doc)
+    if not current_user.get("profile"):
+        raise HTTPException(status_code=400, detail="Please complete your profile first")
     
+    profile = current_user["profile"]
+    
+    async def event_stream():
+        days = []
+        try:
+            cached = await lookup_meal_plan_cache(profile, force_refresh)
+            
+            if cached is not None:
+                days = cached["days"]
+                for day in days:
+                    yield format_sse("day", day)
+            else:
+                async for day in generate_meal_plan_days_with_ai(profile):
+                    days.append(day)
+                    yield format_sse("day", day)
+                await store_cached_meal_plan(profile, {"days": days})
+            
+            # Persist only once the whole week has been generated
+            meal_plan_data = add_dining_out_flags({"days": days})
+            meal_plan_id = await save_meal_plan(current_user["user_id"], meal_plan_data)
+            yield format_sse("done", {
+                "meal_plan_id": meal_plan_id,
+                "meal_plan": meal_plan_data,
+                "message": "Meal plan generated successfully"
+            })
+        except Exception as e:
+            logger.exception("Error streaming meal plan")
+            yield format_sse("error", {"detail": f"Failed to generate meal plan: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/meal-plan/jobs/{job_id}")
+async def get_generation_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the status of a queued meal plan generation job"""
+    
+    job = await db.jobs.find_one(
+        {"job_id": job_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "job_id": 1, "status": 1, "meal_plan_id": 1, "error": 1, "attempts": 1, "created_at": 1, "updated_at": 1}
+    )
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    job["created_at"] = job["created_at"].isoformat()
+    job["updated_at"] = job["updated_at"].isoformat()
+    return job
+
+@app.get("/api/llm/pool/stats")
+async def get_llm_limiter_stats():
+    """Concurrency limiter, latency, timeout and hedging stats for this process"""
+    acquisitions = llm_limiter.metrics["acquisitions"]
     return {
-        "meal_plan_id": meal_plan_id,
-        "meal_plan": meal_plan_data,
-        "message": "Meal plan generated successfully"
+        "size": llm_limiter.size,
+        "model": llm_backend.model_name,
+        **llm_limiter.metrics,
+        "wait_seconds_avg": llm_limiter.metrics["wait_seconds_total"] / acquisitions if acquisitions else 0.0,
+        **llm_metrics,
+        "latency": {
+            kind: {
+                "p50_seconds": tracker.percentile(0.5),
+                "p95_seconds": tracker.percentile(0.95),
+                "timeout_seconds": tracker.timeout()
+            }
+            for kind, tracker in llm_latency.items()
+        },
+        "breaker_state": llm_breaker.state,
+        "breaker_trips": llm_breaker.trips,
+        "breaker_short_circuits": llm_breaker.short_circuits,
+        "hedging_enabled": LLM_HEDGING_ENABLED
     }
 
+@app.get("/api/meal-plan/cache/stats")
+async def get_meal_plan_cache_stats():
+    """Hit/miss counters for the meal plan cache in this process"""
+    served = cache_metrics["hits"] + cache_metrics["band_hits"]
+    lookups = served + cache_metrics["misses"]
+    return {
+        **cache_metrics,
+        "hit_rate": served / lookups if lookups else 0.0
+    }
+
+@app.get("/api/meal-plan/history")
+async def get_meal_plan_history(cursor: Optional[str] = None, limit: int = HISTORY_DEFAULT_LIMIT, current_user: dict = Depends(get_current_user)):
+    """Page through the user's meal plans, newest first, as summaries without recipes.
+    
+    Pages are keyed on (created_at, meal_plan_id) rather than skipped, so every page
+    is a bounded scan of the (user_id, created_at, meal_plan_id) index.
+    """
+    
+    if limit < 1 or limit > HISTORY_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {HISTORY_MAX_LIMIT}")
+    
+    position = decode_history_cursor(cursor) if cursor else None
+    pipeline = build_history_pipeline(current_user["user_id"], position, limit + 1)
+    meal_plans = await db.meal_plans.aggregate(pipeline).to_list(length=limit + 1)
+    
+    next_cursor = None
+    if len(meal_plans) > limit:
+        meal_plans = meal_plans[:limit]
+        next_cursor = encode_history_cursor(meal_plans[-1]["created_at"], meal_plans[-1]["meal_plan_id"])
+    
+    for meal_plan in meal_plans:
+        meal_plan["total_calories"] = sum(meal_plan["daily_calories"] or [])
+    
+    return AppJSONResponse({
+        "meal_plans": meal_plans,
+        "next_cursor": next_cursor
+    })
+
 @app.get("/api/meal-plan/latest")
 async def get_latest_meal_plan(current_user: dict = Depends(get_current_user)):
     """Get the latest meal plan for the current user"""
     
     meal_plan = await db.meal_plans.find_one(
         {"user_id": current_user["user_id"]},
+        {"_id": 0, "meal_plan_id": 1, "meal_plan": 1, "created_at": 1},
         sort=[("created_at", -1)]
     )
     
     if not meal_plan:
         raise HTTPException(status_code=404, detail="No meal plan found. Please generate one first.")
     
-    return {
+    return AppJSONResponse({
         "meal_plan_id": meal_plan["meal_plan_id"],
         "meal_plan": meal_plan["meal_plan"],
         "created_at": meal_plan["created_at"]
-    }
+    })
 
 @app.put("/api/meal-plan/update-meal")
 async def update_meal_dining_status(request: UpdateMealRequest, current_user: dict = Depends(get_current_user)):
     """Update dining out status for a specific meal"""
     
-    meal_plan = await db.meal_plans.find_one({
-        "meal_plan_id": request.meal_plan_id,
-        "user_id": current_user["user_id"]
+    if request.meal_type not in MEAL_TYPES:
+        raise HTTPException(status_code=400, detail="meal_type must be breakfast, lunch or dinner")
+    
+    # Single positional update of the one flag; the filter also requires the day to exist
+    result = await db.meal_plans.update_one(
+        {
+            "meal_plan_id": request.meal_plan_id,
+            "user_id": current_user["user_id"],
+            "meal_plan.days.day": request.day
+        },
+        {"$set": {f"meal_plan.days.$[d].{request.meal_type}.dining_out": request.dining_out}},
+        array_filters=[{"d.day": request.day}]
+    )
+    
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Meal plan not found")
+    
+    return {"message": "Meal updated successfully"}
+
+@app.patch("/api/meal-plan/{meal_plan_id}/dining-out")
+async def update_dining_out_bulk(meal_plan_id: str, request: BulkDiningOutRequest, current_user: dict = Depends(get_current_user)):
+    """Apply several dining out changes in one atomic update and return the new grocery list"""
+    
+    if not request.changes:
+        raise HTTPException(status_code=400, detail="changes must not be empty")
+    
+    updates = {}
+    for change in request.changes:
+        if change.day < 1 or change.day > 7:
+            raise HTTPException(status_code=400, detail="day must be between 1 and 7")
+        if change.meal_type not in MEAL_TYPES:
+            raise HTTPException(status_code=400, detail="meal_type must be breakfast, lunch or dinner")
+        # One array filter per day; a later change to the same meal wins
+        updates[f"meal_plan.days.$[d{change.day}].{change.meal_type}.dining_out"] = change.dining_out
+    
+    days = sorted({change.day for change in request.changes})
+    meal_plan = await db.meal_plans.find_one_and_update(
+        {
+            "meal_plan_id": meal_plan_id,
+            "user_id": current_user["user_id"],
+            "meal_plan.days.day": {"$all": days}
+        },
+        {"$set": updates},
+        array_filters=[{f"d{day}.day": day} for day in days],
+        projection=GROCERY_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    
+    if not meal_plan:
+        raise HTTPException(status_code=404, detail="Meal plan not found")
+    
+    return AppJSONResponse({
+        "meal_plan_id": meal_plan_id,
+        "updated": len(updates),
+        "ingredients": build_grocery_list(meal_plan["meal_plan"])
     })
+
+@app.post("/api/meal-plan/{meal_plan_id}/regenerate")
+async def regenerate_meal(meal_plan_id: str, request: RegenerateMealRequest, current_user: dict = Depends(get_current_user)):
+    """Regenerate a single meal or a single day of a meal plan in place"""
+    
+    if request.day < 1 or request.day > 7:
+        raise HTTPException(status_code=400, detail="day must be between 1 and 7")
+    if request.meal_type is not None and request.meal_type not in MEAL_TYPES:
+        raise HTTPException(status_code=400, detail="meal_type must be breakfast, lunch or dinner")
+    if not current_user.get("profile"):
+        raise HTTPException(status_code=400, detail="Please complete your profile first")
+    
+    meal_plan = await db.meal_plans.find_one(
+        {"meal_plan_id": meal_plan_id, "user_id": current_user["user_id"]},
+        {"_id": 0, "meal_plan.days": 1}
+    )
     
     if not meal_plan:
         raise HTTPException(status_code=404, detail="Meal plan not found")
     
-    # Update the specific meal's dining_out status
     days = meal_plan["meal_plan"]["days"]
-    for day in days:
-        if day["day"] == request.day:
-            if request.meal_type in day:
-                day[request.meal_type]["dining_out"] = request.dining_out
-                break
+    current_day = next((day for day in days if day.get("day") == request.day), None)
+    if current_day is None:
+        raise HTTPException(status_code=404, detail=f"Day {request.day} not found in meal plan")
+    
+    # The rest of the week is passed as context so the new meals do not repeat it
+    replaced = [request.meal_type] if request.meal_type else MEAL_TYPES
+    week_meals = [
+        day[meal_type]["name"]
+        for day in days
+        for meal_type in MEAL_TYPES
+        if meal_type in day and not (day is current_day and meal_type in replaced)
+    ]
+    
+    profile = current_user["profile"]
+    try:
+        # A fallback meal is not a regeneration, so an open breaker is reported instead
+        if request.meal_type:
+            meal = await generate_meal_with_ai(profile, request.day, request.meal_type, week_meals, current_day.get(request.meal_type), fallback_when_open=False)
+        else:
+            new_day = await generate_day_with_ai(profile, request.day, week_meals, fallback_when_open=False)
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Meal generation is temporarily unavailable, please try again shortly")
+    except Exception as e:
+        logger.exception("Error regenerating meal", extra={"meal_plan_id": meal_plan_id, "day": request.day, "meal_type": request.meal_type})
+        raise HTTPException(status_code=500, detail=f"Failed to regenerate meal: {str(e)}")
     
-    # Save updated meal plan
+    if request.meal_type:
+        if meal is None:
+            raise HTTPException(status_code=500, detail="Failed to regenerate meal")
+        new_meals = {request.meal_type: meal}
+    else:
+        if new_day is None:
+            raise HTTPException(status_code=500, detail="Failed to regenerate day")
+        new_meals = {meal_type: new_day[meal_type] for meal_type in MEAL_TYPES}
+    
+    for meal in new_meals.values():
+        meal["dining_out"] = False
+    
+    # Positional update of just the regenerated slots
+    update = {"$set": {f"meal_plan.days.$[d].{meal_type}": meal for meal_type, meal in new_meals.items()}}
+    if not request.meal_type and not new_day.get("fallback"):
+        update["$unset"] = {"meal_plan.days.$[d].fallback": ""}
     await db.meal_plans.update_one(
-        {"meal_plan_id": request.meal_plan_id},
-        {"$set": {"meal_plan.days": days}}
+        {"meal_plan_id": meal_plan_id, "user_id": current_user["user_id"]},
+        update,
+        array_filters=[{"d.day": request.day}]
     )
     
-    return {"message": "Meal updated successfully"}
+    return AppJSONResponse({
+        "meal_plan_id": meal_plan_id,
+        "day": request.day,
+        "meals": new_meals,
+        "message": "Meal regenerated successfully"
+    })
 
 @app.get("/api/grocery-list/{meal_plan_id}")
 async def get_grocery_list(meal_plan_id: str, current_user: dict = Depends(get_current_user)):
     """Generate a grocery list from the meal plan"""
     
-    meal_plan = await db.meal_plans.find_one({
-        "meal_plan_id": meal_plan_id,
-        "user_id": current_user["user_id"]
-    })
+    meal_plan = await db.meal_plans.find_one(
+        {"meal_plan_id": meal_plan_id, "user_id": current_user["user_id"]},
+        GROCERY_PROJECTION
+    )
     
     if not meal_plan:
         raise HTTPException(status_code=404, detail="Meal plan not found")
     
-    # Aggregate all ingredients from meals that are not marked as dining_out
-    all_ingredients = []
-    
-    for day in meal_plan["meal_plan"]["days"]:
-        for meal_type in ["breakfast", "lunch", "dinner"]:
-            if meal_type in day:
-                meal = day[meal_type]
-                # Only include meals that are not dining out
-                if not meal.get("dining_out", False):
-                    ingredients = meal.get("recipe", {}).get("ingredients", [])
-                    all_ingredients.extend(ingredients)
-    
-    return {
+    return AppJSONResponse({
         "meal_plan_id": meal_plan_id,
-        "ingredients": all_ingredients
-    }
+        "ingredients": build_grocery_list(meal_plan["meal_plan"])
+    })
 
 if __name__ == "__main__":
     import uvicorn
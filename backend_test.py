@@ -51,6 +51,8 @@ class NutriPlanAPITester:
                 response = requests.post(url, json=data, headers=headers, timeout=timeout)
             elif method.upper() == "PUT":
                 response = requests.put(url, json=data, headers=headers, timeout=timeout)
+            elif method.upper() == "PATCH":
+                response = requests.patch(url, json=data, headers=headers, timeout=timeout)
             else:
                 return False, {"error": f"Unsupported method: {method}"}
             
@@ -237,6 +239,63 @@ class NutriPlanAPITester:
         
         return False
     
+    def test_generate_meal_plan_stream(self):
+        """Test streaming meal plan generation over Server-Sent Events"""
+        url = f"{self.api_base}/meal-plan/generate/stream"
+        headers = {"Authorization": f"Bearer {self.access_token}"}
+        
+        try:
+            response = requests.get(url, headers=headers, stream=True, timeout=120)
+            events = []
+            event_name = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event_name = line[len("event: "):]
+                elif line.startswith("data: "):
+                    events.append((event_name, json.loads(line[len("data: "):])))
+        except Exception as e:
+            self.log_test("Generate Meal Plan Stream", False, "Streaming request failed", {"error": str(e)})
+            return False
+        
+        day_events = [data for name, data in events if name == "day"]
+        done_events = [data for name, data in events if name == "done"]
+        
+        if len(day_events) == 7 and done_events and "meal_plan_id" in done_events[0]:
+            self.meal_plan_id = done_events[0]["meal_plan_id"]
+            self.log_test("Generate Meal Plan Stream", True, "Streamed 7 days and saved meal plan", {
+                "meal_plan_id": self.meal_plan_id
+            })
+            return True
+        
+        self.log_test("Generate Meal Plan Stream", False, f"Expected 7 day events and a done event, got {len(day_events)} days", {
+            "events": [name for name, _ in events]
+        })
+        return False
+    
+    def test_generate_meal_plan_job(self):
+        """Test queued meal plan generation with job status polling"""
+        success, response = self.make_request("POST", "/meal-plan/generate?mode=job&force_refresh=true")
+        
+        if not success or "job_id" not in response:
+            self.log_test("Generate Meal Plan Job", False, "Failed to enqueue generation job", response)
+            return False
+        
+        job_id = response["job_id"]
+        deadline = time.time() + 120
+        while time.time() < deadline:
+            success, response = self.make_request("GET", f"/meal-plan/jobs/{job_id}")
+            if success and response.get("status") in ("done", "failed"):
+                break
+            time.sleep(2)
+        
+        if success and response.get("status") == "done" and response.get("meal_plan_id"):
+            self.meal_plan_id = response["meal_plan_id"]
+            self.log_test("Generate Meal Plan Job", True, "Job completed with a meal plan", response)
+            return True
+        
+        self.log_test("Generate Meal Plan Job", False, "Job did not complete", response)
+        return False
+    
     def test_get_latest_meal_plan(self):
         """Test getting latest meal plan"""
         success, response = self.make_request("GET", "/meal-plan/latest")
@@ -252,6 +311,36 @@ class NutriPlanAPITester:
         else:
             self.log_test("Get Latest Meal Plan", False, "Failed to get latest meal plan", response)
     
+    def test_meal_plan_history(self):
+        """Test paging through meal plan history"""
+        success, response = self.make_request("GET", "/meal-plan/history?limit=1")
+        
+        if not success or not response.get("meal_plans"):
+            self.log_test("Meal Plan History", False, "Failed to get meal plan history", response)
+            return False
+        
+        first = response["meal_plans"][0]
+        if "meal_plan" in first or "total_calories" not in first:
+            self.log_test("Meal Plan History", False, "History entries are not summaries", first)
+            return False
+        
+        seen = [first["meal_plan_id"]]
+        cursor = response.get("next_cursor")
+        while cursor:
+            success, response = self.make_request("GET", f"/meal-plan/history?limit=1&cursor={cursor}")
+            if not success:
+                self.log_test("Meal Plan History", False, "Failed to fetch next history page", response)
+                return False
+            seen.extend(meal_plan["meal_plan_id"] for meal_plan in response["meal_plans"])
+            cursor = response.get("next_cursor")
+        
+        if len(seen) == len(set(seen)) and seen[0] == self.meal_plan_id:
+            self.log_test("Meal Plan History", True, f"Paged through {len(seen)} meal plans, newest first", None)
+            return True
+        
+        self.log_test("Meal Plan History", False, "History pages repeated plans or were out of order", {"meal_plan_ids": seen})
+        return False
+    
     def test_update_meal_dining_status(self):
         """Test updating meal dining out status"""
         if not self.meal_plan_id:
@@ -274,6 +363,54 @@ class NutriPlanAPITester:
             self.log_test("Update Meal Dining Status", False, "Failed to update meal dining status", response)
             return False
     
+    def test_regenerate_meal(self):
+        """Test regenerating a single meal in place"""
+        if not self.meal_plan_id:
+            self.log_test("Regenerate Meal", False, "No meal plan ID available", None)
+            return False
+        
+        data = {"day": 2, "meal_type": "dinner"}
+        success, response = self.make_request("POST", f"/meal-plan/{self.meal_plan_id}/regenerate", data, timeout=60)
+        
+        if not success or "dinner" not in response.get("meals", {}):
+            self.log_test("Regenerate Meal", False, "Failed to regenerate meal", response)
+            return False
+        
+        new_name = response["meals"]["dinner"]["name"]
+        success, response = self.make_request("GET", "/meal-plan/latest")
+        stored_day = next((day for day in response.get("meal_plan", {}).get("days", []) if day.get("day") == 2), {})
+        
+        if success and stored_day.get("dinner", {}).get("name") == new_name:
+            self.log_test("Regenerate Meal", True, f"Day 2 dinner replaced with {new_name}", None)
+            return True
+        
+        self.log_test("Regenerate Meal", False, "Regenerated meal was not saved to the plan", response)
+        return False
+    
+    def test_bulk_dining_out(self):
+        """Test marking a whole weekend as dining out in one request"""
+        if not self.meal_plan_id:
+            self.log_test("Bulk Dining Out", False, "No meal plan ID available", None)
+            return False
+        
+        success, before = self.make_request("GET", f"/grocery-list/{self.meal_plan_id}")
+        changes = [
+            {"day": day, "meal_type": meal_type, "dining_out": True}
+            for day in (6, 7) for meal_type in ("breakfast", "lunch", "dinner")
+        ]
+        success, response = self.make_request("PATCH", f"/meal-plan/{self.meal_plan_id}/dining-out", {"changes": changes})
+        
+        if not success or "ingredients" not in response:
+            self.log_test("Bulk Dining Out", False, "Failed to apply bulk dining out update", response)
+            return False
+        
+        if len(response["ingredients"]) < len(before.get("ingredients", [])):
+            self.log_test("Bulk Dining Out", True, f"{response['updated']} meals marked, grocery list now has {len(response['ingredients'])} ingredients", None)
+            return True
+        
+        self.log_test("Bulk Dining Out", False, "Grocery list did not shrink after marking meals as dining out", response)
+        return False
+    
     def test_get_grocery_list(self):
         """Test getting grocery list and verify dining_out exclusion"""
         if not self.meal_plan_id:
@@ -364,9 +501,14 @@ class NutriPlanAPITester:
             print("❌ Cannot continue tests - meal plan generation failed")
             return
         
+        self.test_generate_meal_plan_stream()
+        self.test_generate_meal_plan_job()
         self.test_get_latest_meal_plan()
+        self.test_meal_plan_history()
         self.test_update_meal_dining_status()
+        self.test_regenerate_meal()
         self.test_get_grocery_list()
+        self.test_bulk_dining_out()
         
         # Error case tests
         self.test_error_cases()
@@ -167,7 +167,9 @@ function App() {
     setLoading(true);
     setError('');
     try {
-      const response = await fetch(`${API_URL}/api/meal-plan/generate`, {
+      // Regenerating an existing plan must bypass the meal plan cache
+      const query = mealPlan ? '?force_refresh=true' : '';
+      const response = await fetch(`${API_URL}/api/meal-plan/generate${query}`, {
         method: 'POST',
         headers: { 'Authorization': `Bearer ${token}` }
       });
@@ -192,21 +194,22 @@ function App() {
     const currentStatus = dayData[mealType].dining_out;
     
     try {
-      const response = await fetch(`${API_URL}/api/meal-plan/update-meal`, {
-        method: 'PUT',
+      const response = await fetch(`${API_URL}/api/meal-plan/${mealPlanId}/dining-out`, {
+        method: 'PATCH',
         headers: {
           'Content-Type': 'application/json',
           'Authorization': `Bearer ${token}`
         },
         body: JSON.stringify({
-          meal_plan_id: mealPlanId,
-          day: day,
-          meal_type: mealType,
-          dining_out: !currentStatus
+          changes: [{ day: day, meal_type: mealType, dining_out: !currentStatus }]
         })
       });
       
       if (response.ok) {
+        // The response carries the updated grocery list
+        const data = await response.json();
+        setGroceryList(data.ingredients);
+        
         // Update local state
         const updatedMealPlan = { ...mealPlan };
         const dayIndex = updatedMealPlan.days.findIndex(d => d.day === day);
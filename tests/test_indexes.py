@@ -0,0 +1,123 @@
+"""
+Check that the queries behind the API endpoints are served by the indexes
+created in ensure_indexes() rather than collection scans.
+
+Needs a reachable MongoDB (MONGO_URL, default mongodb://localhost:27017) and
+the backend dependencies; the tests are skipped otherwise. A throwaway
+database is created and dropped.
+"""
+
+import os
+import sys
+import uuid
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+server = pytest.importorskip("server")
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+
+@pytest.fixture(scope="module")
+def db():
+    client = pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except PyMongoError as e:
+        pytest.skip(f"MongoDB not reachable at {MONGO_URL}: {e}")
+
+    name = f"nutriplan_index_test_{uuid.uuid4().hex[:8]}"
+    original_db = server.db
+    # A client of its own, bound to the event loop that provisions the indexes
+    server.db = server.AsyncIOMotorClient(MONGO_URL)[name]
+
+    async def provision():
+        await server.ensure_indexes()
+        # Startup runs this on every boot, so a second pass must be a no-op
+        await server.ensure_indexes()
+
+    asyncio.run(provision())
+
+    database = client[name]
+    now = datetime.utcnow()
+    database.users.insert_many([
+        {"user_id": f"user-{i}", "username": f"user{i}", "password": "x", "profile": None}
+        for i in range(20)
+    ])
+    database.meal_plans.insert_many([
+        {"meal_plan_id": f"plan-{i}", "user_id": f"user-{i % 20}", "meal_plan": {"days": []}, "created_at": (now - timedelta(hours=i)).isoformat()}
+        for i in range(100)
+    ])
+    database.jobs.insert_many([
+        {"job_id": f"job-{i}", "user_id": f"user-{i % 20}", "status": "done", "created_at": now}
+        for i in range(20)
+    ])
+    try:
+        yield database
+    finally:
+        server.db = original_db
+        client.drop_database(name)
+        client.close()
+
+def plan_stages(plan: dict):
+    """All stage names of an explain() winning plan"""
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+def winning_plans(explain: dict):
+    """Winning plans of a find() or aggregate explain, wherever the stages put them"""
+    if isinstance(explain, dict):
+        if "winningPlan" in explain:
+            yield explain["winningPlan"]
+        for value in explain.values():
+            yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for value in explain:
+            yield from winning_plans(value)
+
+def assert_no_collscan(explain: dict):
+    plans = list(winning_plans(explain))
+    assert plans, explain
+    for plan in plans:
+        assert "COLLSCAN" not in set(plan_stages(plan)), plan
+
+# (collection, filter, sort) of each find() issued by an endpoint; the job
+# filters come from the helpers the claim path itself uses
+ENDPOINT_QUERIES = [
+    ("users", {"username": "user3"}, None),                                  # register, login
+    ("users", {"user_id": "user-3"}, None),                                  # get_current_user, profile update
+    ("meal_plans", {"user_id": "user-3"}, [("created_at", -1)]),             # latest
+    ("meal_plans", {"meal_plan_id": "plan-3", "user_id": "user-3"}, None),   # grocery list, update, regenerate
+    ("meal_plans", {"meal_plan_id": "plan-3"}, None),                        # single-flight waiters
+    ("jobs", {"job_id": "job-3", "user_id": "user-3"}, None),                # job status
+    ("jobs", server.claimable_jobs_filter(datetime.utcnow()), [("created_at", 1)]),  # job claim
+    ("jobs", server.exhausted_jobs_filter(datetime.utcnow()), None),         # failing abandoned jobs
+    ("meal_plan_cache", {"band_key": "band"}, None),                         # plan reuse
+]
+
+@pytest.mark.parametrize("collection,query,sort", ENDPOINT_QUERIES)
+def test_endpoint_query_uses_index(db, collection, query, sort):
+    cursor = db[collection].find(query).limit(1)
+    if sort:
+        cursor = cursor.sort(sort)
+    assert_no_collscan(cursor.explain())
+
+@pytest.mark.parametrize("position", [None, ("2030-01-01T00:00:00", "plan-50")])
+def test_history_pipeline_uses_index(db, position):
+    # The exact pipeline get_meal_plan_history runs, first page and after a cursor
+    pipeline = server.build_history_pipeline("user-3", position, 21)
+    assert_no_collscan(db.command("aggregate", "meal_plans", pipeline=pipeline, explain=True))
+
+def test_ensure_indexes_is_idempotent(db):
+    indexes = db.users.index_information()
+    assert any(index["key"] == [("username", 1)] and index.get("unique") for index in indexes.values())
+    assert any(index["key"] == [("user_id", 1)] and index.get("unique") for index in indexes.values())
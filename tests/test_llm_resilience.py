@@ -0,0 +1,235 @@
+"""
+Offline tests for the LLM circuit breaker, adaptive timeouts, hedging and
+meal plan validation. Needs the backend dependencies; skipped otherwise.
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+server = pytest.importorskip("server")
+
+class ScriptedBackend(server.LLMBackend):
+    """Answers each call with the next (delay, response) pair"""
+
+    model_name = "scripted"
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = 0
+
+    async def send_prompt(self, prompt: str, system_message: str) -> str:
+        delay, response = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        await asyncio.sleep(delay)
+        return response
+
+DAY_RESPONSE = server.FakeLLMBackend().build_response(server.random.Random(1), "Create day 1 of a plan")
+
+@pytest.fixture(autouse=True)
+def fresh_llm_state(monkeypatch):
+    monkeypatch.setattr(server, "llm_breaker", server.CircuitBreaker())
+    monkeypatch.setattr(server, "llm_latency", {kind: server.LatencyTracker() for kind in server.LLM_PROMPT_KINDS})
+    monkeypatch.setattr(server, "llm_metrics", dict.fromkeys(server.llm_metrics, 0))
+
+def trip(breaker: server.CircuitBreaker):
+    for _ in range(server.LLM_BREAKER_MIN_CALLS):
+        breaker.record(False, 1.0)
+
+def open_window_elapsed(breaker: server.CircuitBreaker):
+    breaker.opened_at -= server.LLM_BREAKER_OPEN_SECONDS
+
+# ---- Circuit breaker ----
+
+def test_breaker_trips_on_error_rate():
+    breaker = server.CircuitBreaker()
+    trip(breaker)
+    assert breaker.state == "open"
+    assert breaker.trips == 1
+    assert not breaker.allow_request()
+    assert breaker.short_circuits == 1
+
+def test_breaker_trips_on_slow_rate():
+    breaker = server.CircuitBreaker()
+    for _ in range(server.LLM_BREAKER_MIN_CALLS):
+        breaker.record(True, server.LLM_BREAKER_SLOW_SECONDS)
+    assert breaker.state == "open"
+
+def test_breaker_waits_for_min_calls():
+    breaker = server.CircuitBreaker()
+    for _ in range(server.LLM_BREAKER_MIN_CALLS - 1):
+        breaker.record(False, 1.0)
+    assert breaker.state == "closed"
+
+def test_half_open_lets_one_probe_through():
+    breaker = server.CircuitBreaker()
+    trip(breaker)
+    open_window_elapsed(breaker)
+    assert breaker.allow_request()
+    assert breaker.state == "half_open"
+    assert not breaker.allow_request()
+
+def test_successful_probe_closes_breaker():
+    breaker = server.CircuitBreaker()
+    trip(breaker)
+    open_window_elapsed(breaker)
+    breaker.allow_request()
+    breaker.record(True, 1.0)
+    assert breaker.state == "closed"
+    assert not breaker.outcomes
+
+@pytest.mark.parametrize("ok,seconds", [(False, 1.0), (True, server.LLM_BREAKER_SLOW_SECONDS)])
+def test_failed_or_slow_probe_reopens_breaker(ok, seconds):
+    breaker = server.CircuitBreaker()
+    trip(breaker)
+    open_window_elapsed(breaker)
+    breaker.allow_request()
+    breaker.record(ok, seconds)
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+    assert not breaker.probe_in_flight
+
+def test_cancelled_probe_is_released(monkeypatch):
+    monkeypatch.setattr(server, "llm_backend", ScriptedBackend((10, DAY_RESPONSE)))
+    server.llm_breaker.state = "half_open"
+
+    async def cancel_probe():
+        task = asyncio.create_task(server.send_llm_prompt("prompt", "day"))
+        await asyncio.sleep(0.01)
+        assert server.llm_breaker.probe_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+
+    # The next caller gets to probe instead of being short-circuited forever
+    assert server.llm_breaker.state == "half_open"
+    assert not server.llm_breaker.probe_in_flight
+    assert server.llm_breaker.allow_request()
+
+# ---- Adaptive timeouts ----
+
+def test_timeout_uses_default_until_enough_samples():
+    tracker = server.LatencyTracker(min_samples=20)
+    for _ in range(19):
+        tracker.record(1.0)
+    assert tracker.timeout() == server.LLM_TIMEOUT_DEFAULT_SECONDS
+
+@pytest.mark.parametrize("latency,expected", [
+    (0.1, server.LLM_TIMEOUT_MIN_SECONDS),
+    (1000.0, server.LLM_TIMEOUT_MAX_SECONDS),
+    (20.0, min(server.LLM_TIMEOUT_MAX_SECONDS, max(server.LLM_TIMEOUT_MIN_SECONDS, 20.0 * server.LLM_TIMEOUT_P95_MULTIPLIER))),
+])
+def test_timeout_is_clamped(latency, expected):
+    tracker = server.LatencyTracker(min_samples=20)
+    for _ in range(20):
+        tracker.record(latency)
+    assert tracker.timeout() == expected
+
+def test_short_calls_do_not_shrink_the_week_timeout():
+    for _ in range(50):
+        server.llm_latency["day"].record(4.0)
+    assert server.llm_latency["day"].timeout() == server.LLM_TIMEOUT_MIN_SECONDS
+    assert server.llm_latency["week"].timeout() == server.LLM_TIMEOUT_DEFAULT_SECONDS
+
+# ---- Hedging ----
+
+def prime_latency(kind: str, seconds: float):
+    for _ in range(server.llm_latency[kind].min_samples):
+        server.llm_latency[kind].record(seconds)
+
+def test_hedge_wins_when_primary_is_slow(monkeypatch):
+    prime_latency("day", 0.02)
+    backend = ScriptedBackend((5, DAY_RESPONSE), (0, DAY_RESPONSE))
+    monkeypatch.setattr(server, "llm_backend", backend)
+
+    assert asyncio.run(server.send_hedged_llm_prompt("prompt", "day")) == DAY_RESPONSE
+    assert backend.calls == 2
+    assert server.llm_metrics["hedges"] == 1
+    assert server.llm_metrics["hedge_wins"] == 1
+
+def test_no_hedge_while_primary_is_within_p95(monkeypatch):
+    prime_latency("day", 1.0)
+    backend = ScriptedBackend((0, DAY_RESPONSE))
+    monkeypatch.setattr(server, "llm_backend", backend)
+
+    assert asyncio.run(server.send_hedged_llm_prompt("prompt", "day")) == DAY_RESPONSE
+    assert backend.calls == 1
+    assert server.llm_metrics["hedges"] == 0
+
+def test_invalid_first_response_does_not_win(monkeypatch):
+    prime_latency("day", 0.02)
+    backend = ScriptedBackend((0.05, '{"days": [{"day": 1'), (0.1, DAY_RESPONSE))
+    monkeypatch.setattr(server, "llm_backend", backend)
+
+    assert asyncio.run(server.send_hedged_llm_prompt("prompt", "day")) == DAY_RESPONSE
+    assert server.llm_metrics["hedge_wins"] == 1
+
+def test_single_meal_response_can_win(monkeypatch):
+    prime_latency("meal", 0.02)
+    meal_response = server.FakeLLMBackend().build_response(server.random.Random(1), "Create a new lunch for day 3 of a plan")
+    backend = ScriptedBackend((5, meal_response), (0, meal_response))
+    monkeypatch.setattr(server, "llm_backend", backend)
+
+    assert asyncio.run(server.send_hedged_llm_prompt("prompt", "meal", ["lunch"])) == meal_response
+    assert server.llm_metrics["hedge_wins"] == 1
+
+def test_hedge_skipped_over_inflight_budget(monkeypatch):
+    prime_latency("day", 0.02)
+    monkeypatch.setattr(server, "LLM_INFLIGHT_BUDGET", 1)
+    backend = ScriptedBackend((0.1, DAY_RESPONSE))
+    monkeypatch.setattr(server, "llm_backend", backend)
+
+    assert asyncio.run(server.send_hedged_llm_prompt("prompt", "day")) == DAY_RESPONSE
+    assert backend.calls == 1
+    assert server.llm_metrics["hedges_skipped"] == 1
+
+# ---- Validation ----
+
+@pytest.mark.parametrize("value,expected", [
+    ("350 kcal", 350.0),
+    ("1,200", 1200.0),
+    ("12.5g", 12.5),
+    ("about 8 grams", 8.0),
+    (15, 15),
+])
+def test_coerce_number(value, expected):
+    assert server.coerce_number(value) == expected
+
+def test_coerce_number_rejects_text_without_digits():
+    with pytest.raises(ValueError):
+        server.coerce_number("a lot")
+
+def make_meal(**nutrition):
+    return {
+        "name": "Oatmeal",
+        "recipe": {"ingredients": ["1 cup oats"], "instructions": ["Cook oats"]},
+        "nutrition": {"calories": "350 kcal", "protein": "12g", "carbs": 60, "fat": 8, "fiber": 6, "sugar": 15, **nutrition}
+    }
+
+def test_validate_meal_plan_coerces_units():
+    plan, invalid = server.validate_meal_plan({"days": [{meal_type: make_meal() for meal_type in server.MEAL_TYPES}]})
+    assert not invalid
+    day = plan["days"][0]
+    assert day["day"] == 1
+    assert day["breakfast"]["nutrition"]["calories"] == 350.0
+    assert day["lunch"]["nutrition"]["protein"] == 12.0
+
+def test_validate_meal_plan_reports_each_invalid_slot():
+    day = {"day": 4, "breakfast": make_meal(), "lunch": make_meal(fat="lots"), "dinner": make_meal(sugar=-3)}
+    del day["dinner"]["recipe"]["instructions"]
+    plan, invalid = server.validate_meal_plan({"days": [day]})
+
+    assert [(slot["day"], slot["meal_type"]) for slot in invalid] == [(4, "lunch"), (4, "dinner")]
+    assert [error["loc"] for error in invalid[0]["errors"]] == ["nutrition.fat"]
+    assert {error["loc"] for error in invalid[1]["errors"]} == {"recipe.instructions", "nutrition.sugar"}
+    # Invalid slots are left untouched for regeneration
+    assert plan["days"][0]["lunch"]["nutrition"]["fat"] == "lots"
+
+def test_validate_meal_plan_reports_missing_slot():
+    _, invalid = server.validate_meal_plan({"days": [{"breakfast": make_meal(), "lunch": make_meal()}]})
+    assert [(slot["day"], slot["meal_type"]) for slot in invalid] == [(1, "dinner")]
@@ -0,0 +1,141 @@
+"""
+Offline tests for the streaming meal plan parser and truncated-JSON repair.
+"""
+
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+from meal_plan_parser import MEAL_TYPES, NUTRITION_FIELDS, MealPlanStreamParser, repair_truncated_json
+
+def make_meal(name: str) -> dict:
+    return {
+        "name": name,
+        "recipe": {"ingredients": ["1 cup oats", "1 banana"], "instructions": ["Cook oats", "Add \"sliced\" banana"]},
+        "nutrition": dict(zip(NUTRITION_FIELDS, [350, 12, 60, 8, 6, 15]))
+    }
+
+def make_plan(days: int = 7) -> dict:
+    return {"days": [
+        {"day": day, **{meal_type: make_meal(f"{meal_type} {day}") for meal_type in MEAL_TYPES}}
+        for day in range(1, days + 1)
+    ]}
+
+PLAN_TEXT = json.dumps(make_plan(), indent=2)
+
+def parse(text: str, chunk_size: int = None, **kwargs) -> MealPlanStreamParser:
+    parser = MealPlanStreamParser(**kwargs)
+    chunk_size = chunk_size or len(text) or 1
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+    return parser
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, None])
+def test_chunked_feeding_yields_every_day(chunk_size):
+    parser = parse(PLAN_TEXT, chunk_size)
+    assert parser.complete
+    assert [day["day"] for day in parser.days] == list(range(1, 8))
+    assert parser.days == make_plan()["days"]
+    assert not parser.failed_days
+
+def test_feed_returns_days_as_they_complete():
+    parser = MealPlanStreamParser()
+    first_day_end = PLAN_TEXT.index('"day": 2')
+    assert [day["day"] for day in parser.feed(PLAN_TEXT[:first_day_end])] == [1]
+    assert len(parser.feed(PLAN_TEXT[first_day_end:])) == 6
+
+@pytest.mark.parametrize("noise", [
+    "```json\n{text}\n```",
+    "Here is your meal plan:\n{text}\nEnjoy!",
+    "Here is {{your}} plan: ```json {text}```",
+    "Notes: {{a: [1, 2]}} and {{b}}\n{text}",
+])
+def test_fences_and_preamble_noise_are_skipped(noise):
+    parser = parse(noise.format(text=PLAN_TEXT), chunk_size=5)
+    assert parser.complete
+    assert len(parser.days) == 7
+
+def test_trailing_text_after_root_is_ignored():
+    parser = parse(PLAN_TEXT + "\n\nLet me know {if} you want changes.")
+    assert parser.complete
+    assert len(parser.days) == 7
+
+def test_failed_days_are_reported_with_their_position():
+    plan = make_plan()
+    del plan["days"][2]["lunch"]
+    text = json.dumps(plan).replace('"day": 5,', '"day": 5,,')
+    parser = parse(text, chunk_size=11)
+    assert parser.complete
+    assert [day["day"] for day in parser.days] == [1, 2, 4, 6, 7]
+    assert [failed["index"] for failed in parser.failed_days] == [3, 5]
+    assert "missing lunch" in parser.failed_days[0]["error"]
+
+def test_meal_types_limits_required_meals():
+    text = json.dumps({"days": [{"day": 2, "dinner": make_meal("Stew")}]})
+    assert len(parse(text, meal_types=["dinner"]).days) == 1
+    assert parse(text).failed_days
+
+def test_compact_schema_is_expanded():
+    nutrition = [350, 12, 60, 8, 6, 15]
+    compact = {"day": 1, **{key: [f"meal {key}", ["x"], ["y"], nutrition] for key in "bld"}}
+    parser = parse(json.dumps({"days": [compact]}), compact=True)
+    assert parser.days[0]["breakfast"]["nutrition"] == dict(zip(NUTRITION_FIELDS, nutrition))
+
+def test_text_without_root_never_starts():
+    parser = parse("Sorry, I cannot help with that.")
+    assert not parser.started
+    assert not parser.days
+
+@pytest.mark.parametrize("text,expected", [
+    ('{"a": [1, 2, {"b": "x\\"y', {"a": [1, 2, {}]}),
+    ('{"a": {"b": 1}, "c": "tru', {"a": {"b": 1}}),
+    ('{"a": 1, "b"', {"a": 1}),
+    ('{"a": 1, "b": ', {"a": 1}),
+    ('{"x": [', {"x": []}),
+    ('{"n": 35', {}),
+    ('[1, [2, 3], {"k": "v"}', [1, [2, 3], {"k": "v"}]),
+    ('{"done": true} trailing', {"done": True}),
+])
+def test_repair_truncated_json(text, expected):
+    assert json.loads(repair_truncated_json(text)) == expected
+
+def test_repair_without_container_returns_none():
+    assert repair_truncated_json("") is None
+    assert repair_truncated_json('"just a string') is None
+
+def test_repair_yields_valid_json_at_every_offset():
+    text = json.dumps(make_plan(2))
+    for offset in range(1, len(text) + 1):
+        repaired = repair_truncated_json(text[:offset])
+        assert repaired is not None
+        json.loads(repaired)
+
+def test_truncation_at_every_offset_keeps_only_complete_days():
+    text = json.dumps(make_plan(3))
+    day_ends = [text.index('"day": 2') - 2, text.index('"day": 3') - 2, text.rindex("}}") + 2]
+    for offset in range(len(text)):
+        parser = parse(text[:offset])
+        parser.repair()
+        complete = sum(1 for end in day_ends if offset >= end)
+        # The day in progress is salvaged once its last meal's nutrition has closed
+        assert len(parser.days) in (complete, complete + 1)
+        for day in parser.days:
+            assert day == make_plan(3)["days"][day["day"] - 1]
+
+def test_repair_salvages_a_day_cut_after_its_last_meal():
+    text = json.dumps(make_plan(2))
+    cut = text.rindex("}}") + 1  # inside day 2's closing brace
+    parser = parse(text[:cut])
+    assert len(parser.days) == 1
+    assert parser.repair()["day"] == 2
+    assert len(parser.days) == 2
+
+def test_repair_rejects_a_day_missing_nutrition():
+    text = json.dumps(make_plan(2))
+    cut = text.rindex('"sugar"')
+    parser = parse(text[:cut])
+    assert parser.repair() is None
+    assert "missing sugar" in parser.failed_days[-1]["error"]